@@ -0,0 +1,162 @@
+"""Audits the memory the SpaceWarp engine allocates, frame by frame and line by line"""
+from __future__ import annotations
+from argparse import ArgumentParser
+from os import path
+from typing import Callable
+import sys
+import tracemalloc
+from bench import trace
+from main import App, DIFFICULTIES, PLAYING, RESOURCE_FILE, Replay, ReplayError
+
+AUDIT_FRAMES: int = 3000
+# frames played before measuring, past the 256 frames the frame counter is a cached small int
+WARM_UP: int = 300
+STEADY_FRAMES: int = 300
+# CPython makes a new object for every int above 256 an expression gives, like a tile index
+# or the frame counter, they are freed right away and a frame can hold two at once
+INT_SLACK: int = 64
+SOURCES: tuple[str, ...] = tuple(
+    path.join(path.dirname(path.abspath(__file__)), name) for name in ("main.py",)
+)
+
+
+class Meter:
+    """Measures the bytes a call allocates, minus what measuring itself allocates"""
+    def __init__(self):
+        self.kept: int = 0
+        self.overhead: int = 0
+        # measuring nothing still counts the ints the byte counts are returned in
+        self.kept, self.overhead = (
+            max(values) for values in zip(*(self.measure(lambda: None) for _ in range(10)))
+        )
+
+    def measure(self, func: Callable[[], object]) -> tuple[int, int]:
+        """Calls func, returns the bytes it kept and the most it held at once"""
+        base = tracemalloc.get_traced_memory()[0]
+        tracemalloc.reset_peak()
+        func()
+        current, peak = tracemalloc.get_traced_memory()
+        return current - base - self.kept, max(0, peak - base - self.overhead)
+
+
+class Site:
+    """What one line of the engine allocated over the audited frames"""
+    def __init__(self, line: str):
+        self.line: str = line
+        self.size: int = 0 # bytes still held at the end of the frame
+        self.count: int = 0 # blocks still held at the end of the frame
+        self.frames: int = 0 # frames the line allocated on
+
+
+def play(app: App, meter: Meter, inputs: bytes | list[int], top: int) -> int:
+    """
+    Plays inputs frame by frame, prints the frames that allocated and the lines that kept memory
+    Returns how many frames allocated anything
+    """
+    only_engine = [tracemalloc.Filter(True, source) for source in SOURCES]
+    snapshot = tracemalloc.take_snapshot().filter_traces(only_engine)
+    sites: dict[str, Site] = {}
+    worst: list[tuple[int, int, int]] = [] # (peak, frame, kept)
+    allocating = 0
+    frames = 0
+
+    for frame, buttons in enumerate(inputs):
+        if app.game_state != PLAYING:
+            break
+        frames += 1
+        kept, peak = meter.measure(lambda: app.step(buttons))
+        if peak > INT_SLACK or kept:
+            allocating += 1
+            worst.append((peak, frame, kept))
+        if not kept:
+            continue
+
+        # only frames that kept memory change the snapshot, so only they are compared
+        new = tracemalloc.take_snapshot().filter_traces(only_engine)
+        for stat in new.compare_to(snapshot, "lineno"):
+            if stat.size_diff <= 0:
+                continue
+            where = stat.traceback[0]
+            line = f"{path.basename(where.filename)}:{where.lineno}"
+            site = sites.setdefault(line, Site(line))
+            site.size += stat.size_diff
+            site.count += max(0, stat.count_diff)
+            site.frames += 1
+        snapshot = new
+
+    print(f"{frames} frames, {allocating} allocated more than {INT_SLACK} bytes")
+    if worst:
+        print(f"\n{'frame':>8}{'peak bytes':>12}{'kept bytes':>12}")
+        for peak, frame, kept in sorted(worst, reverse=True)[:top]:
+            print(f"{frame:>8}{peak:>12}{kept:>12}")
+    if sites:
+        print(f"\n{'line':<16}{'frames':>8}{'blocks':>8}{'bytes':>10}{'bytes/frame':>13}")
+        for site in sorted(sites.values(), key=lambda site: site.size, reverse=True)[:top]:
+            print(f"{site.line:<16}{site.frames:>8}{site.count:>8}{site.size:>10}"
+                  f"{site.size / frames:>13.1f}")
+    return allocating
+
+
+def check(app: App, meter: Meter) -> int:
+    """
+    Stands still in the first room of Easy, where nothing moves, and returns how many frames
+    allocated, which should be none: no memory kept and nothing above INT_SLACK
+    """
+    app.difficulty = 1
+    app.start()
+    # through step() like a real frame, so the recording of the inputs is measured too
+    for _ in range(WARM_UP):
+        app.step(0)
+
+    failed = 0
+    for frame in range(STEADY_FRAMES):
+        kept, peak = meter.measure(lambda: app.step(0))
+        if kept or peak > INT_SLACK:
+            failed += 1
+            print(f"frame {frame}: kept {kept} bytes, held {peak} bytes at once")
+    return failed
+
+
+def main() -> int:
+    """Runs the audit, returns the exit code"""
+    parser = ArgumentParser(description=__doc__)
+    parser.add_argument("resource", nargs="?", default=RESOURCE_FILE, help="the .pyxres file")
+    parser.add_argument(
+        "-d", "--difficulty", type=int, default=1, help="the difficulty to play (1-4)"
+    )
+    parser.add_argument("--replay", help="play the inputs of this replay instead of a trace")
+    parser.add_argument("-s", "--seed", type=int, default=0, help="the seed of the trace")
+    parser.add_argument("-n", "--top", type=int, default=20, help="how many frames and lines")
+    parser.add_argument(
+        "--check", action="store_true",
+        help="exit with 1 if a frame in a room where nothing happens allocates"
+    )
+    args = parser.parse_args()
+
+    app = App(headless=True, resource=args.resource)
+    inputs: bytes | list[int] = trace(args.seed, AUDIT_FRAMES)
+    app.difficulty = args.difficulty
+    if args.replay:
+        try:
+            replay = Replay.load(args.replay)
+        except (OSError, ReplayError) as error:
+            print(f"{args.replay}: error: {error}")
+            return 1
+        inputs = replay.inputs
+        app.difficulty = replay.difficulty
+
+    tracemalloc.start()
+    meter = Meter()
+    if args.check:
+        failed = check(app, meter)
+        print(f"{STEADY_FRAMES - failed} of {STEADY_FRAMES} steady frames allocated nothing")
+        return int(failed > 0)
+
+    print(f"{DIFFICULTIES[app.difficulty - 1]}, {meter.overhead} bytes of overhead measured")
+    app.start()
+    play(app, meter, inputs, args.top)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
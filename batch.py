@@ -0,0 +1,228 @@
+"""Plays many SpaceWarp games at once with NumPy, for training and testing automated players"""
+from __future__ import annotations
+from main import (
+    BTN_LEFT, BTN_R, BTN_RIGHT, BTN_SPACE, BTN_UP, BUTTONS, COLLIDER, DOORS, FIRE, KEY, KEYS,
+    RESOURCE_FILE, SHIP, TILE_FLAGS, load_level
+)
+
+try:
+    import numpy as np
+except ImportError as error: # NumPy is only needed here, the game doesn't use it
+    raise ImportError("batch.py needs NumPy, install it with pip install numpy") from error
+
+# keys, buttons and doors come in 3 colours, numbered by the x of their door sprite minus 4
+COLOURS: int = 3
+
+
+class BatchEnv:
+    """
+    Runs n games of one difficulty side by side, every array has one row per game
+    Follows Player.update() and App.update() exactly, but without menus, drawing or Q
+    """
+    def __init__(self, resource: str = RESOURCE_FILE):
+        self.resource: str = resource
+        self.n: int = 0
+
+    def reset(self, n: int, difficulty: int) -> np.ndarray:
+        """Starts n new games of a difficulty, returns the first observations"""
+        level = load_level(difficulty, self.resource)
+        self.nrooms: int = level.nrooms
+        width = self.nrooms * 16
+
+        # the tiles that never change, with the keys and doors taken out since they can go away
+        tiles = np.zeros((16, width), np.uint16)
+        for room in range(self.nrooms):
+            tiles[:, room * 16:room * 16 + 16] = np.frombuffer(
+                level.room(room).tiles, np.uint16
+            ).reshape(16, 16)
+        flags = np.frombuffer(TILE_FLAGS, np.uint8)[tiles]
+        self.key_colour: np.ndarray = np.full((16, width), -1, np.int8)
+        self.button_colour: np.ndarray = np.full((16, width), -1, np.int8)
+        self.door_colour: np.ndarray = np.full((16, width), -1, np.int8)
+        for sprites, colours in (
+            (KEYS, self.key_colour), (BUTTONS, self.button_colour), (DOORS, self.door_colour)
+        ):
+            for sprite in sprites:
+                colour = sprite[1] - 4 if sprites is KEYS else sprite[0] - 4
+                colours[tiles == sprite[0] + sprite[1] * 32] = colour
+        self.flags: np.ndarray = np.where(
+            (self.key_colour >= 0) | (self.door_colour >= 0), 0, flags
+        ).astype(np.uint8)
+
+        # which colours of keys each room has, a key only opens doors if its room has its colour
+        self.room_keys: np.ndarray = np.zeros((self.nrooms, COLOURS), bool)
+        for y, x in zip(*np.nonzero(self.key_colour >= 0)):
+            self.room_keys[x // 16, self.key_colour[y, x]] = True
+
+        self.n = n
+        self.x: np.ndarray = np.full(n, level.spawn[0], np.int32)
+        self.y: np.ndarray = np.full(n, level.spawn[1], np.int32)
+        self.jumping: np.ndarray = np.zeros(n, np.int32)
+        self.camera: np.ndarray = np.zeros(n, np.int32)
+        self.spawn_x: np.ndarray = self.x.copy()
+        self.spawn_y: np.ndarray = self.y.copy()
+        self.win: np.ndarray = np.zeros(n, bool)
+        self.frames: np.ndarray = np.zeros(n, np.int32) # frames played until the win
+
+        # the entities of every room, like Keys.state, Buttons.state, Doors.state and Doors.timer
+        self.keys: np.ndarray = np.ones((n, self.nrooms, COLOURS), bool)
+        self.buttons: np.ndarray = np.zeros((n, self.nrooms, COLOURS), np.int32)
+        self.doors: np.ndarray = np.ones((n, self.nrooms, COLOURS), bool)
+        self.timers: np.ndarray = np.zeros((n, self.nrooms, COLOURS), np.int32)
+        self.rows: np.ndarray = np.arange(n)
+
+        # what App.save_state() keeps for each game: its room and that room's entities
+        self.saved_room: np.ndarray = np.zeros(n, np.int32)
+        self.saved: list[np.ndarray] = [
+            np.zeros((n, COLOURS), entities.dtype)
+            for entities in (self.keys, self.buttons, self.doors, self.timers)
+        ]
+        self.save_state(self.rows)
+        return self.observe()
+
+    def observe(self) -> np.ndarray:
+        """Returns each game's player x, y, jumping counter and room as an (n, 4) array"""
+        return np.stack((self.x, self.y, self.jumping, self.camera), axis=1)
+
+    def save_state(self, rows: np.ndarray) -> None:
+        """App.save_state() for some of the games, keeping the room their camera is in"""
+        self.saved_room[rows] = self.camera[rows]
+        for saved, entities in zip(self.saved, (self.keys, self.buttons, self.doors, self.timers)):
+            saved[rows] = entities[rows, self.camera[rows]]
+
+    def load_state(self, rows: np.ndarray) -> None:
+        """App.load_state() for some of the games"""
+        for saved, entities in zip(self.saved, (self.keys, self.buttons, self.doors, self.timers)):
+            entities[rows, self.saved_room[rows]] = saved[rows]
+
+    def flags_at(self, x: np.ndarray, y: np.ndarray) -> np.ndarray:
+        """TileGrid.flags_at() in every game, with the keys and doors each one has left"""
+        width = self.nrooms * 16
+        inside = (0 <= x) & (x < width) & (0 <= y) & (y < 16)
+        x = np.clip(x, 0, width - 1)
+        y = np.clip(y, 0, 15)
+        room = x // 16
+
+        flags = self.flags[y, x].copy()
+        door = self.door_colour[y, x]
+        closed = (door >= 0) & self.doors[self.rows, room, door] & (
+            self.timers[self.rows, room, door] == 0
+        )
+        flags[closed] |= COLLIDER
+        key = self.key_colour[y, x]
+        flags[(key >= 0) & self.keys[self.rows, room, key]] |= KEY
+        return np.where(inside, flags, 0)
+
+    def collides(self, x: np.ndarray, y: np.ndarray) -> np.ndarray:
+        """Whether the tile at x, y is a collider in each game"""
+        return (self.flags_at(x, y) & COLLIDER) > 0
+
+    def update_position(self, buttons: np.ndarray) -> None:
+        """Player.update_position() for every game"""
+        x, y = self.x, self.y
+        falling = ~self.collides(x // 8, y // 8 + 1) & ~self.collides((x + 7) // 8, y // 8 + 1)
+        y += np.where(falling & (self.jumping == 0), 2, 0)
+        jump = ~falling & ((buttons & (BTN_UP | BTN_SPACE)) > 0)
+        self.jumping[jump] = 12
+
+        ceiling = self.collides(x // 8, (y - 1) // 8) | self.collides((x + 7) // 8, (y - 1) // 8)
+        self.jumping[ceiling] = 0
+        rising = self.jumping > 0
+        self.jumping[rising] -= 1
+        y[rising] -= 2
+
+        right = ((buttons & BTN_RIGHT) > 0) & ~self.collides(x // 8 + 1, y // 8) & ~self.collides(
+            x // 8 + 1, (y + 7) // 8
+        )
+        left = ~right & (x > 0) & ((buttons & BTN_LEFT) > 0) & ~self.collides(
+            (x - 1) // 8, y // 8
+        ) & ~self.collides((x - 1) // 8, (y + 7) // 8)
+        x += right.astype(np.int32) - left.astype(np.int32)
+
+    def press(self, rows: np.ndarray, bx: np.ndarray, by: np.ndarray, colour: np.ndarray) -> None:
+        """Buttons.press() then Doors.button_open() for the games standing on a button"""
+        room = self.camera[rows]
+        x, y = self.x[rows], self.y[rows]
+        state = self.buttons[rows, room, colour]
+        full = (bx * 8 - 4 <= x) & (x <= bx * 8 + 4) & (by * 8 == y)
+        half = ~full & (bx * 8 - 5 <= x) & (x <= bx * 8 + 5) & (by * 8 - 1 <= y) & (
+            y <= by * 8
+        ) & (state <= 2)
+        edge = ~full & ~half & (bx * 8 - 6 <= x) & (x <= bx * 8 + 6) & (by * 8 - 2 < y) & (
+            y <= by * 8
+        ) & (state <= 1)
+        state = np.select((full, half, edge), (150, 2, 1), state)
+        self.buttons[rows, room, colour] = state
+        self.timers[rows, room, colour] = np.maximum(self.timers[rows, room, colour], state)
+
+    def step(self, actions: np.ndarray) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """
+        Plays one frame of every game with the BTN_ flags in actions
+        Returns the observations, which games are won and which died this frame
+        Won games stay as they are, reset() to play again
+        """
+        actions = np.asarray(actions, np.int32)
+        playing = ~self.win
+        self.frames[playing] += 1
+
+        # App.update(): a new room becomes the respawn point and its state is saved
+        room = (self.x + 4) // 128
+        moved = playing & (room != self.camera)
+        if moved.any():
+            rows = np.nonzero(moved)[0]
+            self.spawn_x[rows] = self.x[rows] + 4 - 8 * (self.camera[rows] > room[rows])
+            self.spawn_y[rows] = self.y[rows]
+            self.camera[rows] = room[rows]
+            self.save_state(rows)
+
+        # Player.update()
+        x, y, jumping = self.x.copy(), self.y.copy(), self.jumping.copy()
+        self.update_position(actions)
+        self.x[self.win], self.y[self.win], self.jumping[self.win] = (
+            x[self.win], y[self.win], jumping[self.win]
+        )
+
+        corners = (
+            (self.x // 8, self.y // 8),
+            (self.x // 8, (self.y + 7) // 8),
+            ((self.x + 7) // 8, self.y // 8),
+            ((self.x + 7) // 8, (self.y + 7) // 8)
+        )
+        corner_flags = [self.flags_at(cx, cy) for cx, cy in corners]
+        dead = playing & (
+            ((actions & BTN_R) > 0)
+            | np.any([(flags & FIRE) > 0 for flags in corner_flags], axis=0)
+        )
+        self.x[dead], self.y[dead], self.jumping[dead] = (
+            self.spawn_x[dead], self.spawn_y[dead], 0
+        )
+
+        for (cx, cy), flags in zip(corners, corner_flags):
+            inside = (0 <= cx) & (cx < self.nrooms * 16) & (0 <= cy) & (cy < 16)
+            cx, cy = np.clip(cx, 0, self.nrooms * 16 - 1), np.clip(cy, 0, 15)
+
+            key = self.key_colour[cy, cx]
+            collect = playing & (key >= 0) & ((flags & KEY) > 0)
+            collect &= self.room_keys[self.camera, np.maximum(key, 0)]
+            rows = np.nonzero(collect)[0]
+            self.keys[rows, self.camera[rows], key[rows]] = False
+            self.doors[rows, self.camera[rows], key[rows]] = False
+
+            button = self.button_colour[cy, cx]
+            rows = np.nonzero(
+                playing & inside & (button >= 0) & (cx // 16 == self.camera)
+            )[0]
+            if rows.size:
+                self.press(rows, cx[rows], cy[rows], button[rows])
+
+            self.win |= playing & ((flags & SHIP) > 0)
+
+        # App.update() after the player
+        rows = np.nonzero(dead)[0]
+        if rows.size:
+            self.load_state(rows)
+        rooms = np.nonzero(playing)[0]
+        camera = self.camera[rooms]
+        self.timers[rooms, camera] = np.maximum(self.timers[rooms, camera] - 1, 0)
+        self.buttons[rooms, camera] = np.maximum(self.buttons[rooms, camera] - 1, 0)
+        return self.observe(), self.win.copy(), dead
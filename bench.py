@@ -0,0 +1,268 @@
+"""Benchmarks the SpaceWarp engine without a window and compares the results to a baseline"""
+from __future__ import annotations
+from argparse import ArgumentParser
+from random import Random
+from statistics import median
+from typing import Callable
+import json
+import platform
+import sys
+import time
+from main import (
+    App, BTN_LEFT, BTN_RIGHT, BTN_UP, BUTTONS, COLLIDER, DIFFICULTIES, DOOR_OF, FIRE,
+    LEVEL_CACHE, LEVEL_TILEMAPS, RESOURCE_FILE, SPAWN_TILE, TILE_FLAGS, Buttons, Doors, END_TILE,
+    EMPTY_TILE, Level, StreamedLevel, Tile, TileGrid, load_level, load_tilemaps, parse_level
+)
+
+SYNTHETIC_ROOMS: tuple[int, ...] = tuple(range(1, 17))
+STATE_ROOMS: tuple[int, ...] = (1, 2, 4, 8, 16)
+DENSE_BUTTONS: int = 256 # a room where every tile is a button of the same colour
+TRACE_FRAMES: int = 3000
+# the inputs of the scripted traces, each is held for a random number of frames
+TRACE_INPUTS: tuple[int, ...] = (
+    BTN_RIGHT, BTN_RIGHT | BTN_UP, BTN_LEFT, BTN_LEFT | BTN_UP, BTN_UP, 0
+)
+
+
+def measure(func: Callable[..., object], *args: object, number: int) -> float:
+    """Runs func(*args) number times, returns the seconds per call"""
+    start = time.perf_counter()
+    for _ in range(number):
+        func(*args)
+    return (time.perf_counter() - start) / number
+
+
+def summary(times: list[float]) -> dict[str, float | int]:
+    """The best, median and worst of the seconds per call of each round"""
+    return {"best": min(times), "median": median(times), "worst": max(times), "repeat": len(times)}
+
+
+def synthetic_level(source: TileGrid, nrooms: int) -> TileGrid:
+    """Makes a tilemap of nrooms rooms by repeating the rooms of a real one"""
+    width = used_rooms(source)
+    tiles = TileGrid(16 * 16, 16)
+    for room in range(nrooms):
+        copied = room % width
+        for y in range(16):
+            for x in range(16):
+                tile = source.pget(copied * 16 + x, y)
+                if room and tile in SPAWN_TILE:
+                    tile = EMPTY_TILE
+                tiles.pset(room * 16 + x, y, tile)
+    if nrooms < 16:
+        tiles.pset(nrooms * 16, 0, END_TILE)
+    return tiles
+
+
+def used_rooms(source: TileGrid) -> int:
+    """Returns how many rooms at the start of a tilemap have anything in them"""
+    rooms = 0
+    for room in range(source.width // 16):
+        if any(source.pget(room * 16 + x, y) != EMPTY_TILE for x in range(16) for y in range(16)):
+            rooms = room + 1
+    return rooms
+
+
+def standing_spot(level: Level | StreamedLevel, room: int) -> tuple[int, int] | None:
+    """Returns the leftmost place in a room the player can stand, in pixels"""
+    tiles = level.room(room).tiles
+    for x in range(16):
+        for y in range(15):
+            if (
+                not TILE_FLAGS[tiles[y * 16 + x]] & (COLLIDER | FIRE)
+                and TILE_FLAGS[tiles[y * 16 + 16 + x]] & COLLIDER
+            ):
+                return (room * 16 + x) * 8, y * 8
+    return None
+
+
+def trace(seed: int, frames: int = TRACE_FRAMES) -> list[int]:
+    """Returns a scripted list of inputs, the same for the same seed"""
+    random = Random(seed)
+    inputs: list[int] = []
+    while len(inputs) < frames:
+        inputs += [random.choice(TRACE_INPUTS)] * random.randint(1, 20)
+    return inputs[:frames]
+
+
+def cold_start(app: App) -> None:
+    """
+    Starts the game with nothing cached in memory, parsing the tilemap even if levels.py
+    compiled the levels, so runs compare the same work whether or not it was run
+    """
+    LEVEL_CACHE.clear()
+    app.start(load_level(app.difficulty, app.resource, compiled=False))
+
+
+def respawn(app: App) -> None:
+    """Saves then loads the state of the room the camera is in, like a death right after entering"""
+    app.save_state()
+    app.load_state()
+
+
+def press_under(button_at: dict[Tile, Buttons], corner: Tile, doors: dict[Tile, Doors]) -> None:
+    """Presses the button under a corner of the player the way Player.update() does"""
+    button_at[corner].press(corner, corner[0] * 8, corner[1] * 8, doors)
+
+
+def bench_parse(results: dict, tilemaps: list[TileGrid], resource: str) -> None:
+    """Times parsing every difficulty and App.start() on a cold level cache"""
+    app = App(headless=True, resource=resource)
+    for difficulty, name in enumerate(DIFFICULTIES, 1):
+        results[f"parse/{name}"] = measure(
+            parse_level, tilemaps[LEVEL_TILEMAPS[difficulty][0]], number=5
+        )
+        app.difficulty = difficulty
+        results[f"start/{name}"] = measure(cold_start, app, number=5)
+
+
+def bench_synthetic(results: dict, tilemaps: list[TileGrid], resource: str) -> None:
+    """Times parsing and starting levels of every length, made from the rooms of Hard"""
+    app = App(headless=True, resource=resource)
+    hard = tilemaps[LEVEL_TILEMAPS[3][0]]
+    for nrooms in SYNTHETIC_ROOMS:
+        source = synthetic_level(hard, nrooms)
+        results[f"parse/synthetic-{nrooms}"] = measure(
+            parse_level, source, number=5
+        )
+        results[f"start/synthetic-{nrooms}"] = measure(
+            app.start, parse_level(source), number=5
+        )
+
+
+def bench_state(results: dict, tilemaps: list[TileGrid], resource: str) -> None:
+    """Times a respawn in the last room of longer and longer levels"""
+    app = App(headless=True, resource=resource)
+    for nrooms in STATE_ROOMS:
+        app.start(parse_level(synthetic_level(tilemaps[LEVEL_TILEMAPS[3][0]], nrooms)))
+        app.camera = nrooms - 1
+        app.stream_rooms()
+        results[f"state/rooms-{nrooms}"] = measure(respawn, app, number=2000)
+
+
+def bench_player(results: dict, resource: str) -> None:
+    """Times Player.update() on scripted inputs in every room that has somewhere to stand"""
+    app = App(headless=True, resource=resource)
+    for difficulty, name in enumerate(DIFFICULTIES, 1):
+        app.difficulty = difficulty
+        app.start()
+        for room in range(app.level.nrooms):
+            spot = standing_spot(app.level, room)
+            if spot is None:
+                continue
+            inputs = trace(difficulty * 16 + room)
+
+            app.start()
+            app.camera = room
+            app.stream_rooms()
+            player, controls = app.player, app.controls
+            keys, button_at, doors = app.keys[room], app.button_at[room], app.doors[room]
+            player.x, player.y = spot
+            start = time.perf_counter()
+            for buttons in inputs:
+                controls.feed(buttons)
+                player.update(spot, keys, button_at, doors)
+            results[f"player/{name}-room-{room}"] = (time.perf_counter() - start) / len(inputs)
+
+
+def bench_press(results: dict) -> None:
+    """
+    Times pressing the button under the player in a room packed with buttons of one colour,
+    the press only touches that button however many the room has
+    """
+    sprite = min(BUTTONS)
+    doors = {DOOR_OF[sprite]: Doors(DOOR_OF[sprite])}
+    buttons = Buttons(sprite)
+    for i in range(DENSE_BUTTONS):
+        buttons.add((i % 16, i // 16))
+    button_at = {location: buttons for location in buttons.locations}
+    results["press/dense-room"] = measure(
+        press_under, button_at, (8, 8), doors, number=20000
+    )
+
+
+def compare(results: dict, baseline: dict, tolerance: float) -> list[str]:
+    """
+    Prints how each benchmark changed from the baseline, returns the ones that got slower
+    The best runs are compared, the others are mostly noise from the rest of the machine
+    A benchmark is only slower when its best run is further from the baseline's best than the
+    tolerance plus how far the baseline's median was from its best, so a benchmark that was
+    noisy in the baseline needs a bigger change to be flagged
+    """
+    slower = []
+    for name, result in results.items():
+        if name not in baseline:
+            continue
+        change = result["best"] / baseline[name]["best"] - 1
+        spread = baseline[name]["median"] - baseline[name]["best"]
+        limit = baseline[name]["best"] * (1 + tolerance) + spread
+        flag = ""
+        if result["best"] > limit:
+            slower.append(name)
+            flag = "  SLOWER"
+        print(f"{name:<28}{baseline[name]['best'] * 1e6:>12.2f}{result['best'] * 1e6:>12.2f}"
+              f"{change:>+9.1%}{flag}")
+    return slower
+
+
+def main() -> int:
+    """Runs the benchmarks, returns the exit code"""
+    parser = ArgumentParser(description=__doc__)
+    parser.add_argument("resource", nargs="?", default=RESOURCE_FILE, help="the .pyxres file")
+    parser.add_argument("-o", "--output", help="write the results to this json file")
+    parser.add_argument("-b", "--baseline", help="compare to the results of an earlier run")
+    parser.add_argument(
+        "-t", "--tolerance", type=float, default=0.1,
+        help="how much slower than the baseline a benchmark can get on top of the baseline's "
+        "own spread, 0.1 is 10%%"
+    )
+    parser.add_argument(
+        "-r", "--repeat", type=int, default=7,
+        help="rounds of the whole suite, each benchmark is run once a round"
+    )
+    args = parser.parse_args()
+
+    tilemaps = load_tilemaps(args.resource)
+    # the rounds spread the runs of a benchmark over the whole suite instead of back to back,
+    # so the machine getting slower for a while shows in the worst run and not the best
+    times: dict[str, list[float]] = {}
+    for _ in range(args.repeat):
+        run: dict[str, float] = {}
+        bench_parse(run, tilemaps, args.resource)
+        bench_synthetic(run, tilemaps, args.resource)
+        bench_state(run, tilemaps, args.resource)
+        bench_player(run, args.resource)
+        bench_press(run)
+        for name, seconds in run.items():
+            times.setdefault(name, []).append(seconds)
+    results = {name: summary(runs) for name, runs in times.items()}
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as file:
+            json.dump({
+                "python": platform.python_version(),
+                "machine": platform.machine(),
+                "benchmarks": results,
+            }, file, indent=2)
+
+    if not args.baseline:
+        print(f"{'benchmark':<28}{'median us':>12}{'best us':>12}")
+        for name, result in results.items():
+            print(f"{name:<28}{result['median'] * 1e6:>12.2f}{result['best'] * 1e6:>12.2f}")
+        return 0
+
+    with open(args.baseline, encoding="utf-8") as file:
+        baseline = json.load(file)["benchmarks"]
+    print(f"{'benchmark':<28}{'baseline us':>12}{'now us':>12}{'change':>9}")
+    slower = compare(results, baseline, args.tolerance)
+    if slower:
+        print(
+            f"{len(slower)} benchmark(s) more than {args.tolerance:.0%} slower than the baseline, "
+            "beyond its spread"
+        )
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,27 @@
+"""Compiles the SpaceWarp levels so the game doesn't have to parse them when starting"""
+from __future__ import annotations
+from argparse import ArgumentParser
+import sys
+from main import DIFFICULTIES, LEVELS_SUFFIX, RESOURCE_FILE, TileError, compile_levels
+
+
+def main() -> int:
+    """Compiles every difficulty of the resource file, returns the exit code"""
+    parser = ArgumentParser(description=__doc__)
+    parser.add_argument("resource", nargs="?", default=RESOURCE_FILE, help="the .pyxres file")
+    args = parser.parse_args()
+
+    try:
+        levels = compile_levels(args.resource)
+    except TileError as error:
+        print(f"{args.resource}: {error}")
+        return 1
+
+    for difficulty, level in levels.items():
+        print(f"{DIFFICULTIES[difficulty - 1]}: {level.nrooms} rooms")
+    print(f"wrote {args.resource + LEVELS_SUFFIX}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
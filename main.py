@@ -1,23 +1,67 @@
 """This is the main file for SpaceWarp-Remake"""
 #region imports
 from __future__ import annotations
-from copy import deepcopy
-from webbrowser import open as wb_open
+import time
+IMPORT_START: float = time.perf_counter()
 from math import floor
-from typing import Callable, Any
-import pyxel
-
-
-pyxel.init(128, 128, title="SpaceWarp")
-pyxel.load("assets.pyxres")
-
-tile_at: Callable = pyxel.tilemaps[5].pget
-tile_set: Callable = pyxel.tilemaps[5].pset
+from typing import Callable, Any, Iterable
+from hashlib import sha256
+from os import environ, makedirs, path, stat as os_stat
+from array import array
+from threading import Event, Lock, Thread
+import atexit
+import json
+import sys
+# webbrowser, zipfile and tomllib are slow to import and rarely needed,
+# they are imported where they are used
+
+try:
+    import pyxel
+except ImportError: # headless machines may not have SDL installed
+    pyxel = None
+
+
+RESOURCE_FILE: str = "assets.pyxres"
+LEVELS_SUFFIX: str = ".levels.json" # compiled levels are written next to the .pyxres file
+LEVELS_VERSION: int = 1 # bumped when Level.to_json changes, so older compiled files are parsed
+REPLAY_DIR: str = "replays"
+SPLITS_DIR: str = "splits" # the room by room times of every run, see Splits
+
+# the tilemaps each difficulty is played through, a level carries on into the next tilemap
+# when it fills the one before it (16 rooms, no END_TILE)
+LEVEL_TILEMAPS: dict[int, tuple[int, ...]] = {1: (1,), 2: (2,), 3: (3,), 4: (4,)}
+ROOM_SLOTS: int = 8 # rooms a game keeps tiles for at once, a power of 2, see RoomTiles
+PARSED_ROOMS: int = 8 # rooms a StreamedLevel keeps parsed
+# the rooms kept loaded around the camera, the others only keep the state of their entities
+# the player can step back into the room behind, so it is always loaded too, and all of this
+# has to fit in ROOM_SLOTS
+STREAM_BEHIND: int = 2
+STREAM_AHEAD: int = 1
+
+# set to a .csv or .json file to profile every frame and write the samples there on exit
+PROFILE_ENV: str = "SPACEWARP_PROFILE"
+# set to print how long the import, the window, the assets and the first frame took
+STARTUP_ENV: str = "SPACEWARP_STARTUP"
+# set to reload the rooms of the level being played when the .pyxres file is saved, see LevelWatcher
+WATCH_ENV: str = "SPACEWARP_WATCH"
+WATCH_FRAMES: int = 15 # how often the watcher looks at the file, twice a second
+PROFILE_FILE: str = "profile.json" # used when profiling is turned on with F1 or PROFILE_ENV=1
+PROFILE_FRAMES: int = 300 # how many frames the profiler keeps, 10 seconds
+PROFILE_PHASES: tuple[str, ...] = (
+    "position", "pickups", "save_state", "load_state", "doors", "buttons", "keys",
+    "draw_room", "draw_doors", "draw_buttons", "draw_player"
+)
 
 Tile = tuple[int, int]
 
 # region Constants
 
+# the game logic counts frames (button timers, jumps, the run time), so it always runs at
+# TICK_RATE updates a second whatever the render speed, pyxel.run keeps it there, see Clock
+TICK_RATE: int = 30
+TICK_JITTER: float = 0.25 # an update up to this much of a tick late isn't counted as skipped
+FRAME_BUDGET: float = 1 / TICK_RATE # seconds an update and its render can take to keep up
+
 RIGHT, LEFT = False, True
 TRANSPARENT: int = 0 # used for transparency when drawing
 
@@ -38,13 +82,76 @@ WALLS: set[Tile] = ({(x, y) for x in range(4, 8) for y in range(2)}
 
 COLLIDERS: set[Tile] = WALLS | DOORS
 
+# the top door tile of the doors each key and button opens
+DOOR_OF: dict[Tile, Tile] = {
+    **{(7, y): (y, 4) for y in range(4, 7)},
+    **{(x, 6): (x, 4) for x in range(4, 7)},
+}
+
 END_SHIP_TOP_LEFT: Tile = (0, 4)
 END_SHIP: set[Tile] = {(x, y) for x in range(2) for y in range(4, 6)}
 
+# tiles are stored as ids into the 32x32 tile image, each id has a set of class flags
+TILESET_WIDTH: int = 32
+COLLIDER: int = 1 << 0
+FIRE: int = 1 << 1
+KEY: int = 1 << 2
+BUTTON: int = 1 << 3
+SHIP: int = 1 << 4
+
+def tile_id(tile: Tile) -> int:
+    """Returns the id of a tile"""
+    return tile[0] + tile[1] * TILESET_WIDTH
+
+def id_tile(tile: int) -> Tile:
+    """Returns the tile of an id"""
+    return tile % TILESET_WIDTH, tile // TILESET_WIDTH
+
+TILE_FLAGS: bytearray = bytearray(TILESET_WIDTH * TILESET_WIDTH)
+for _flag, _tiles in (
+    (COLLIDER, COLLIDERS), (FIRE, FIRES), (KEY, KEYS), (BUTTON, BUTTONS), (SHIP, END_SHIP)
+):
+    for _tile in _tiles:
+        TILE_FLAGS[tile_id(_tile)] |= _flag
+
+DIFFICULTIES: tuple[str, ...] = ("Easy", "Normal", "Hard", "Lunatic")
+
 MENU: int = 0
 PLAYING: int = 1
 END: int = 2
 
+# buttons are packed into one int per frame, see Controls
+BTN_LEFT: int = 1 << 0
+BTN_RIGHT: int = 1 << 1
+BTN_UP: int = 1 << 2
+BTN_SPACE: int = 1 << 3
+BTN_R: int = 1 << 4
+BTN_Q: int = 1 << 5
+BTN_DOWN: int = 1 << 6
+BTN_RETURN: int = 1 << 7
+
+BUTTON_KEYS: dict[int, str] = {
+    BTN_LEFT: "KEY_LEFT",
+    BTN_RIGHT: "KEY_RIGHT",
+    BTN_UP: "KEY_UP",
+    BTN_SPACE: "KEY_SPACE",
+    BTN_R: "KEY_R",
+    BTN_Q: "KEY_Q",
+    BTN_DOWN: "KEY_DOWN",
+    BTN_RETURN: "KEY_RETURN",
+}
+
+# rewinding is read on its own, replays keep a byte of BTN_ flags per frame and it needs none
+REWIND_KEY: str = "KEY_BACKSPACE"
+REWIND_FRAMES: int = TICK_RATE * 30 # how far back the rewind goes, 30 seconds
+# inputs of a run the recording has room for up front, 10 minutes, a longer run doubles it
+RECORDING_FRAMES: int = TICK_RATE * 60 * 10
+# the longest replay loaded, an hour, a header asking for more is rejected before it is decoded
+MAX_REPLAY_FRAMES: int = TICK_RATE * 60 * 60
+# ints kept per room state, room_state() of a room with every colour of key, button and door,
+# a door is made from its top tile only and keeps its state, timer and animation state
+REWIND_ROOM: int = len(KEYS) + len(BUTTONS) + 3 * len(TOP_DOORS)
+
 def is_tile(element: Any):
     """Takes in any input, returns true if input is a tile (tuple[int, int])"""
     return (
@@ -62,14 +169,1074 @@ def round_half_up(n: float, decimals: int = 0):
 class TileError(Exception):
     """Misplaced tile"""
 
+class ReplayError(Exception):
+    """Replay that can't be played back"""
+
+
+# region TileGrid
+class TileGrid:
+    """
+    An in-memory tilemap, works like pyxel's Tilemap without needing a window
+    Tiles are kept as ids in a flat array so collision checks are just indexing
+    """
+    def __init__(self, width: int, height: int):
+        self.width: int = width
+        self.height: int = height
+        self.data: array[int] = array("H", bytes(2 * width * height))
+
+    def pget(self, x: int, y: int) -> Tile:
+        """Gets the tile at x, y, anything out of bounds is empty"""
+        if 0 <= x < self.width and 0 <= y < self.height:
+            return id_tile(self.data[y * self.width + x])
+        return EMPTY_TILE
+
+    def pset(self, x: int, y: int, tile: Tile) -> None:
+        """Sets the tile at x, y, anything out of bounds is ignored"""
+        if 0 <= x < self.width and 0 <= y < self.height:
+            self.data[y * self.width + x] = tile_id(tile)
+
+    def id_at(self, x: int, y: int) -> int:
+        """Gets the id of the tile at x, y, anything out of bounds is empty"""
+        if 0 <= x < self.width and 0 <= y < self.height:
+            return self.data[y * self.width + x]
+        return 0
+
+    def flags_at(self, x: int, y: int) -> int:
+        """Gets the class flags (COLLIDER, FIRE...) of the tile at x, y"""
+        if 0 <= x < self.width and 0 <= y < self.height:
+            return TILE_FLAGS[self.data[y * self.width + x]]
+        return 0
+
+
+class RoomTiles(TileGrid):
+    """
+    The tiles of a game, holding only ROOM_SLOTS rooms so long levels take the same memory
+    Room r is kept in slot r % ROOM_SLOTS, x and y are still the level's like in TileGrid,
+    but only rooms loaded with load_room() can be read
+    """
+    def __init__(self, nrooms: int):
+        super().__init__(ROOM_SLOTS * 16, 16)
+        self.stride: int = self.width
+        self.mask: int = self.stride - 1
+        self.width = nrooms * 16
+
+    def load_room(self, room: int, tiles: array) -> None:
+        """Copies the 16 rows of 16 tile ids of a room into its slot"""
+        for y in range(16):
+            start = y * self.stride + (room * 16 & self.mask)
+            self.data[start:start + 16] = tiles[y * 16:y * 16 + 16]
+
+    def pget(self, x: int, y: int) -> Tile:
+        """Gets the tile at x, y, anything out of bounds is empty"""
+        if 0 <= x < self.width and 0 <= y < self.height:
+            return id_tile(self.data[y * self.stride + (x & self.mask)])
+        return EMPTY_TILE
+
+    def pset(self, x: int, y: int, tile: Tile) -> None:
+        """Sets the tile at x, y, anything out of bounds is ignored"""
+        if 0 <= x < self.width and 0 <= y < self.height:
+            self.data[y * self.stride + (x & self.mask)] = tile_id(tile)
+
+    def id_at(self, x: int, y: int) -> int:
+        """Gets the id of the tile at x, y, anything out of bounds is empty"""
+        if 0 <= x < self.width and 0 <= y < self.height:
+            return self.data[y * self.stride + (x & self.mask)]
+        return 0
+
+    def flags_at(self, x: int, y: int) -> int:
+        """Gets the class flags (COLLIDER, FIRE...) of the tile at x, y"""
+        if 0 <= x < self.width and 0 <= y < self.height:
+            return TILE_FLAGS[self.data[y * self.stride + (x & self.mask)]]
+        return 0
+
+
+def load_tilemaps(filename: str = RESOURCE_FILE, height: int = 16) -> list[TileGrid]:
+    """
+    Reads the tilemaps straight out of a .pyxres file, so no window is needed
+    Only the first `height` rows are kept since a level is one room tall
+    """
+    from zipfile import ZipFile
+    import tomllib
+
+    with ZipFile(filename) as archive:
+        resource = tomllib.loads(archive.read("pyxel_resource.toml").decode())
+
+    tilemaps: list[TileGrid] = []
+    for tilemap in resource["tilemaps"]:
+        grid = TileGrid(tilemap["width"], height)
+        # each row is a flat list of x, y pairs with the trailing zeros cut off
+        for y, row in enumerate(tilemap["data"][:height]):
+            for i in range(0, len(row), 2):
+                grid.pset(i // 2, y, (row[i], row[i + 1] if i + 1 < len(row) else 0))
+        tilemaps.append(grid)
+    return tilemaps
+
+def level_hash(tiles: TileGrid) -> bytes:
+    """Hashes every tile of a level, used to check a replay was made on the same level"""
+    return sha256(bytes(n for tile in tiles.data for n in id_tile(tile))).digest()
+
+def resource_hash(filename: str = RESOURCE_FILE) -> bytes:
+    """Hashes a whole .pyxres file"""
+    with open(filename, "rb") as file:
+        return sha256(file.read()).digest()
+
+
+# region Level
+class Room:
+    """The tiles and entities of one room, the tiles are 16 rows of 16 ids"""
+    __slots__ = ("tiles", "keys", "buttons", "doors", "ship")
+
+    def __init__(
+            self,
+            tiles: array,
+            keys: list[Tile],
+            buttons: list[Tile],
+            doors: list[Tile],
+            ship: Tile | None
+        ):
+        self.tiles: array = tiles
+        self.keys: list[Tile] = keys
+        self.buttons: list[Tile] = buttons
+        self.doors: list[Tile] = doors
+        self.ship: Tile | None = ship
+
+
+class Level:
+    """
+    A parsed level: everything App.start() needs without scanning the tilemap again
+    tiles is the collision grid with the spawn removed, never change it, use new_tiles()
+    """
+    def __init__(
+            self,
+            nrooms: int,
+            spawn: Tile,
+            tiles: TileGrid,
+            keys: list[list[Tile]],
+            buttons: list[list[Tile]],
+            doors: list[list[Tile]],
+            ships: dict[int, Tile],
+            digest: bytes
+        ):
+        self.nrooms: int = nrooms
+        self.spawn: Tile = spawn
+        self.tiles: TileGrid = tiles
+        self.keys: list[list[Tile]] = keys
+        self.buttons: list[list[Tile]] = buttons
+        self.doors: list[list[Tile]] = doors
+        self.ships: dict[int, Tile] = ships
+        self.digest: bytes = digest
+
+    def new_tiles(self) -> TileGrid:
+        """Returns a copy of the collision grid for a game to change"""
+        tiles = TileGrid(self.tiles.width, self.tiles.height)
+        tiles.data[:] = self.tiles.data
+        return tiles
+
+    def with_rooms(self, parsed: Level, rooms: Iterable[int], digest: bytes) -> Level:
+        """
+        Returns a copy of the level with some rooms taken from another parse of its tilemap,
+        which can have a different number of rooms
+        """
+        rooms = set(rooms)
+        tiles = TileGrid(parsed.nrooms * 16, 16)
+        keys, buttons, doors = [], [], []
+        ships = {room: ship for room, ship in self.ships.items() if room not in rooms}
+        for room in range(parsed.nrooms):
+            source = parsed if room in rooms else self
+            for y in range(16):
+                start = y * source.tiles.width + room * 16
+                end = y * tiles.width + room * 16
+                tiles.data[end:end + 16] = source.tiles.data[start:start + 16]
+            keys.append(source.keys[room])
+            buttons.append(source.buttons[room])
+            doors.append(source.doors[room])
+            if room in rooms and room in parsed.ships:
+                ships[room] = parsed.ships[room]
+        ships = {room: ship for room, ship in ships.items() if room < parsed.nrooms}
+        spawn = parsed.spawn if 0 in rooms else self.spawn
+        return Level(parsed.nrooms, spawn, tiles, keys, buttons, doors, ships, digest)
+
+    def room(self, room: int) -> Room:
+        """Returns the tiles and entities of a room"""
+        tiles = array("H")
+        for y in range(16):
+            start = y * self.tiles.width + room * 16
+            tiles += self.tiles.data[start:start + 16]
+        return Room(
+            tiles, self.keys[room], self.buttons[room], self.doors[room], self.ships.get(room)
+        )
+
+    def to_json(self) -> dict:
+        """Returns the level as something json can write"""
+        return {
+            "nrooms": self.nrooms,
+            "spawn": self.spawn,
+            "width": self.tiles.width,
+            "height": self.tiles.height,
+            "tiles": self.tiles.data.tolist(),
+            "keys": self.keys,
+            "buttons": self.buttons,
+            "doors": self.doors,
+            "ships": {str(room): ship for room, ship in self.ships.items()},
+            "digest": self.digest.hex(),
+        }
+
+    @classmethod
+    def from_json(cls, data: dict) -> Level:
+        """Makes a level from the output of to_json"""
+        tiles = TileGrid(data["width"], data["height"])
+        tiles.data[:] = array("H", data["tiles"])
+
+        def tile_lists(rooms: list) -> list[list[Tile]]:
+            return [[(x, y) for x, y in room] for room in rooms]
+
+        return cls(
+            data["nrooms"],
+            tuple(data["spawn"]),
+            tiles,
+            tile_lists(data["keys"]),
+            tile_lists(data["buttons"]),
+            tile_lists(data["doors"]),
+            {int(room): tuple(ship) for room, ship in data["ships"].items()},
+            bytes.fromhex(data["digest"])
+        )
+
+
+def get_nrooms(source: TileGrid) -> int:
+    """Gets the number of rooms of a difficulty tilemap"""
+    for i in range(1, 16):
+        if source.pget(16*i, 0) == END_TILE:
+            return i
+    return 16
+
+def parse_level(
+        source: TileGrid,
+        errors: list[TileError] | None = None,
+        rooms: Iterable[int] | None = None,
+        digest: bool = True
+    ) -> Level:
+    """
+    Scans a difficulty tilemap, checks every tile is placed right and returns the level
+    Raises the first TileError, unless errors is given, then every error is added to it
+    rooms limits the scan to some of the rooms, the others are left empty
+    digest=False skips hashing the whole tilemap when only some rooms are needed
+    """
+    tile_at: Callable = source.pget
+
+    def fail(message: str) -> None:
+        if errors is None:
+            raise TileError(message)
+        errors.append(TileError(message))
+
+    def is_ship(x: int, y: int) -> bool:
+        return tile_at(x, y) == END_SHIP_TOP_LEFT and all(
+            tile_at(x + i, y + j) in END_SHIP for i in range(2) for j in range(2)
+        )
+
+    nrooms: int = get_nrooms(source)
+    tiles = TileGrid(nrooms * 16, 16)
+    tile_set: Callable = tiles.pset
+    columns: list[int] = [
+        x for room in (range(nrooms) if rooms is None else rooms)
+        for x in range(room * 16, room * 16 + 16)
+    ]
+
+    spawn: Tile = (0, 0)
+    keys: list[list[Tile]] = [[] for _ in range(nrooms)]
+    buttons: list[list[Tile]] = [[] for _ in range(nrooms)]
+    doors: list[list[Tile]] = [[] for _ in range(nrooms)]
+    ships: dict[int, Tile] = {}
+
+    for y in range(16):
+        for x in columns:
+            tile = tile_at(x, y)
+            if tile in SPAWN_TILE:
+                spawn = x * 8, y * 8
+                tile = EMPTY_TILE
+
+            elif tile in KEYS:
+                keys[x // 16].append((x, y))
+
+            elif tile in BUTTONS:
+                buttons[x // 16].append((x, y))
+
+            elif tile in TOP_DOORS:
+                if y == 15:
+                    fail(f"Top door cannot be at the bottom of the screen at {(x, y)}")
+                elif tile_at(x, y + 1) in BOTTOM_DOORS:
+                    doors[x // 16].append((x, y))
+                else:
+                    fail(f"Missing bottom door at {(x, y + 1)}")
+
+            elif tile in BOTTOM_DOORS:
+                if y == 0:
+                    fail(f"Bottom door cannot be at the top of the screen at {(x, y)}")
+                elif tile_at(x, y - 1) not in TOP_DOORS:
+                    fail(f"Missing top door at {(x, y - 1)}")
+
+            elif tile == END_SHIP_TOP_LEFT:
+                if x // 16 in ships:
+                    fail(f"Cannot have 2 end ships in the same room at {(x, y)}")
+                elif not is_ship(x, y):
+                    fail(f"Incomplete end ship at {(x, y)}")
+                else:
+                    ships[x // 16] = (x, y)
+
+            # every other ship tile has to belong to a whole ship up and to the left of it
+            elif tile in END_SHIP and not any(
+                is_ship(x - i, y - j) for i in range(2) for j in range(2)
+            ):
+                fail(f"Incomplete end ship at {(x, y)}")
+
+            tile_set(x, y, tile)
+
+    return Level(
+        nrooms, spawn, tiles, keys, buttons, doors, ships, level_hash(source) if digest else b""
+    )
+
+
+class StreamedLevel:
+    """
+    A level that carries on over several tilemaps, for campaigns longer than 16 rooms
+    Has what App needs from a Level, but a room is only parsed when the game gets near it,
+    and only the last PARSED_ROOMS parsed are kept
+    """
+    def __init__(self, sources: list[TileGrid]):
+        self.sources: list[TileGrid] = []
+        self.nrooms: int = 0
+        for source in sources:
+            self.sources.append(source)
+            self.nrooms += get_nrooms(source)
+            if get_nrooms(source) < 16:
+                break
+
+        self.parsed: dict[int, Room] = {} # oldest first
+        self.spawn: Tile = parse_level(self.sources[0], rooms=[0], digest=False).spawn
+        self.digest: bytes = sha256(
+            b"".join(level_hash(source) for source in self.sources)
+        ).digest()
+
+    def room(self, room: int) -> Room:
+        """Returns the tiles and entities of a room, parsing it if it isn't kept"""
+        if room in self.parsed:
+            self.parsed[room] = self.parsed.pop(room)
+            return self.parsed[room]
+
+        tilemap, local = divmod(room, 16)
+        parsed = parse_level(self.sources[tilemap], rooms=[local], digest=False).room(local)
+        offset = tilemap * 256
+
+        def shift(tiles: list[Tile]) -> list[Tile]:
+            return [(x + offset, y) for x, y in tiles]
+
+        self.parsed[room] = Room(
+            parsed.tiles,
+            shift(parsed.keys),
+            shift(parsed.buttons),
+            shift(parsed.doors),
+            None if parsed.ship is None else (parsed.ship[0] + offset, parsed.ship[1])
+        )
+        if len(self.parsed) > PARSED_ROOMS:
+            del self.parsed[next(iter(self.parsed))]
+        return self.parsed[room]
+
+LEVEL_CACHE: dict[tuple[bytes, int], Level | StreamedLevel] = {}
+
+def compile_levels(filename: str = RESOURCE_FILE) -> dict[int, Level]:
+    """
+    Parses every difficulty of a .pyxres file and writes them next to it for load_level
+    Difficulties over several tilemaps are left out, they are parsed as they are played
+    """
+    tilemaps = load_tilemaps(filename)
+    levels = {
+        difficulty: parse_level(tilemaps[LEVEL_TILEMAPS[difficulty][0]])
+        for difficulty in range(1, len(DIFFICULTIES) + 1)
+        if len(LEVEL_TILEMAPS[difficulty]) == 1
+    }
+    with open(filename + LEVELS_SUFFIX, "w", encoding="utf-8") as file:
+        json.dump({
+            "version": LEVELS_VERSION,
+            "resource": resource_hash(filename).hex(),
+            "levels": {str(difficulty): level.to_json() for difficulty, level in levels.items()},
+        }, file)
+    return levels
+
+def load_level(
+        difficulty: int,
+        filename: str = RESOURCE_FILE,
+        *,
+        compiled: bool = True
+    ) -> Level | StreamedLevel:
+    """
+    Gets a parsed level, from memory if it was already loaded, then from the file written
+    by compile_levels if it matches the .pyxres file and this version, and only then by parsing
+    the tilemap
+    With compiled=False that file is ignored and the tilemap is always parsed
+    Difficulties over several tilemaps give a StreamedLevel
+    """
+    resource = resource_hash(filename)
+    key = (resource, difficulty)
+    if key in LEVEL_CACHE:
+        return LEVEL_CACHE[key]
+
+    if len(LEVEL_TILEMAPS[difficulty]) > 1:
+        tilemaps = load_tilemaps(filename)
+        level = StreamedLevel([tilemaps[tilemap] for tilemap in LEVEL_TILEMAPS[difficulty]])
+        LEVEL_CACHE[key] = level
+        return level
+
+    level: Level | None = None
+    if compiled:
+        try:
+            with open(filename + LEVELS_SUFFIX, encoding="utf-8") as file:
+                levels = json.load(file)
+            if levels["version"] == LEVELS_VERSION and levels["resource"] == resource.hex():
+                level = Level.from_json(levels["levels"][str(difficulty)])
+        # a missing, older or damaged file only means the tilemap is parsed
+        except (OSError, ValueError, KeyError, TypeError):
+            pass
+
+    if level is None:
+        level = parse_level(load_tilemaps(filename)[LEVEL_TILEMAPS[difficulty][0]])
+
+    LEVEL_CACHE[key] = level
+    return level
+
+
+# region Prefetch
+class Prefetch:
+    """
+    Loads the level of every difficulty on a thread while the menu is up, so Start finds it ready
+    The selected difficulty goes first, stop() before playing so the thread doesn't slow the game
+    """
+    def __init__(self, first: int = 1, resource: str = RESOURCE_FILE):
+        self.resource: str = resource
+        self.order: list[int] = [
+            first, *(difficulty for difficulty in range(1, len(DIFFICULTIES) + 1)
+                     if difficulty != first)
+        ]
+        self.stopped: bool = False
+        self.loading: int | None = None # the difficulty the thread is loading
+        self.loaded: Event = Event() # set when it is done with that difficulty
+        self.lock: Lock = Lock()
+        self.thread: Thread = Thread(target=self.run, name="prefetch", daemon=True)
+        self.thread.start()
+
+    def run(self) -> None:
+        """Loads the levels into LEVEL_CACHE one by one, until they are all loaded or stopped"""
+        from zipfile import BadZipFile
+        for difficulty in self.order:
+            with self.lock:
+                if self.stopped:
+                    return
+                self.loading = difficulty
+                self.loaded.clear()
+            try:
+                load_level(difficulty, self.resource)
+            # a broken or half saved file, start() loads it again and reports what is wrong
+            except (OSError, ValueError, KeyError, BadZipFile, TileError):
+                pass
+            finally:
+                self.loaded.set()
+            # lets the game thread run between levels, so the menu doesn't skip frames
+            time.sleep(0)
+        with self.lock:
+            self.loading = None
+
+    def stop(self, difficulty: int | None = None) -> None:
+        """Stops loading levels, waits for difficulty if the thread is loading it right now"""
+        with self.lock:
+            self.stopped = True
+            wait = difficulty is not None and self.loading == difficulty
+        if wait:
+            self.loaded.wait()
+
+
+# region Hot reload
+def changed_rooms(old: TileGrid, new: TileGrid) -> list[int]:
+    """Returns the rooms whose tiles differ between two versions of a tilemap"""
+    rooms = []
+    for room in range(new.width // 16):
+        for y in range(16):
+            start = y * new.width + room * 16
+            if old.data[start:start + 16] != new.data[start:start + 16]:
+                rooms.append(room)
+                break
+    return rooms
+
+def reload_level(
+        level: Level | StreamedLevel,
+        difficulty: int,
+        old: list[TileGrid],
+        new: list[TileGrid]
+    ) -> tuple[Level | StreamedLevel, list[int]]:
+    """
+    Parses only the rooms of a level that changed between two loads of its tilemaps
+    Returns the new level and those rooms, raises the first TileError found in them
+    """
+    tilemaps = LEVEL_TILEMAPS[difficulty]
+    changed: set[int] = set()
+    for i, tilemap in enumerate(tilemaps):
+        changed.update(i * 16 + room for room in changed_rooms(old[tilemap], new[tilemap]))
+
+    if isinstance(level, StreamedLevel):
+        reloaded = StreamedLevel([new[tilemap] for tilemap in tilemaps])
+        # rooms past the old end were never parsed, even if their tiles are the same
+        changed.update(range(level.nrooms, reloaded.nrooms))
+        rooms = sorted(room for room in changed if room < reloaded.nrooms)
+        reloaded.parsed = {
+            room: parsed for room, parsed in level.parsed.items()
+            if room not in changed and room < reloaded.nrooms
+        }
+        for room in rooms:
+            reloaded.room(room)
+        return reloaded, rooms
+
+    source = new[tilemaps[0]]
+    nrooms = get_nrooms(source)
+    changed.update(range(level.nrooms, nrooms))
+    rooms = sorted(room for room in changed if room < nrooms)
+    parsed = parse_level(source, rooms=rooms, digest=False)
+    return level.with_rooms(parsed, rooms, level_hash(source)), rooms
+
+
+class LevelWatcher:
+    """
+    Watches a .pyxres file while the game runs, for editing levels without restarting
+    Only looks at the file's size and modification time every WATCH_FRAMES frames,
+    the tilemaps are only read again when those changed and so did the file's hash
+    """
+    def __init__(self, filename: str = RESOURCE_FILE):
+        self.filename: str = filename
+        self.stat: tuple[int, int] | None = self.read_stat()
+        self.digest: bytes = resource_hash(filename)
+        self.tilemaps: list[TileGrid] = load_tilemaps(filename) # what the game was loaded from
+        self.frames: int = 0
+
+    def read_stat(self) -> tuple[int, int] | None:
+        """Returns the modification time and size of the file"""
+        try:
+            stat = os_stat(self.filename)
+        except OSError:
+            return None
+        return stat.st_mtime_ns, stat.st_size
+
+    def poll(self) -> list[TileGrid] | None:
+        """Returns the file's tilemaps if it changed since the last time, call once a frame"""
+        self.frames += 1
+        if self.frames < WATCH_FRAMES:
+            return None
+        self.frames = 0
+
+        stat = self.read_stat()
+        if stat is None or stat == self.stat:
+            return None
+        from zipfile import BadZipFile
+        try:
+            digest = resource_hash(self.filename)
+            if digest == self.digest:
+                self.stat = stat
+                return None
+            tilemaps = load_tilemaps(self.filename)
+        except (OSError, ValueError, KeyError, BadZipFile):
+            return None # still being written, it is tried again WATCH_FRAMES frames later
+        self.stat = stat
+        self.digest = digest
+        return tilemaps
+
+
+# region Controls
+class Controls:
+    """Handles the buttons held this frame, packed into an int of BTN_ flags"""
+    def __init__(self):
+        self.state: int = 0
+        self.previous: int = 0
+
+    def feed(self, state: int) -> None:
+        """Sets the buttons held for the next frame"""
+        self.previous = self.state
+        self.state = state
+
+    def btn(self, button: int) -> bool:
+        """Returns true if the button is held"""
+        return bool(self.state & button)
+
+    def btnp(self, button: int) -> bool:
+        """Returns true if the button was pressed this frame"""
+        return bool(self.state & button and not self.previous & button)
+
+
+def read_buttons() -> int:
+    """Reads the keyboard from pyxel and packs it into BTN_ flags"""
+    state = 0
+    for button, key in BUTTON_KEYS.items():
+        if pyxel.btn(getattr(pyxel, key)):
+            state |= button
+    return state
+
+
+# region Clock
+class Clock:
+    """
+    Counts how pyxel keeps the game at TICK_RATE, the game runs one update per pyxel update
+    pyxel.run calls update at a fixed rate, after a slow render it calls it several times
+    before the next render, and drops the updates it can't catch up on
+    """
+    def __init__(self, rate: int = TICK_RATE, timer: Callable[[], float] = time.perf_counter):
+        self.tick: float = 1 / rate
+        self.timer: Callable[[], float] = timer # where the time comes from, for timing.py
+        self.last: float | None = None # when the last update ran
+        self.behind: float = 0.0 # seconds since the first update no update ran for
+        self.updates: int = 0 # updates since the last render
+        self.lag_frames: int = 0 # renders that came after more than one update
+        self.skipped_ticks: int = 0 # updates pyxel dropped because it fell too far behind
+
+    def update(self) -> None:
+        """Counts an update, called once by every pyxel update"""
+        now = self.timer()
+        if self.last is not None:
+            self.behind += now - self.last - self.tick
+        self.last = now
+        self.updates += 1
+
+    def render(self) -> None:
+        """Counts a render, called once by every pyxel draw"""
+        if self.updates > 1:
+            self.lag_frames += 1
+        self.updates = 0
+        # pyxel runs every update it is going to before a render, the time left over had none
+        skipped = int(self.behind / self.tick + TICK_JITTER)
+        if skipped > 0:
+            self.skipped_ticks += skipped
+            self.behind -= skipped * self.tick
+
+
+# region Replay
+class Replay:
+    """
+    A recorded run: the difficulty, a hash of the level and the buttons held every frame
+    Stored as a header followed by run-length encoded (buttons, frames) pairs
+    """
+    MAGIC: bytes = b"SWR1"
+
+    def __init__(self, difficulty: int, level: bytes, inputs: bytes):
+        self.difficulty: int = difficulty
+        self.level: bytes = level
+        self.inputs: bytes = inputs
+
+    def __len__(self) -> int:
+        return len(self.inputs)
+
+    def to_bytes(self) -> bytes:
+        """Encodes the replay"""
+        data = bytearray(self.MAGIC)
+        data.append(self.difficulty)
+        data += self.level
+        write_varint(data, len(self.inputs))
+
+        i = 0
+        while i < len(self.inputs):
+            run = 1
+            while i + run < len(self.inputs) and self.inputs[i + run] == self.inputs[i]:
+                run += 1
+            data.append(self.inputs[i])
+            write_varint(data, run)
+            i += run
+        return bytes(data)
+
+    @classmethod
+    def from_bytes(cls, data: bytes) -> Replay:
+        """Decodes a replay made by to_bytes"""
+        if data[:4] != cls.MAGIC:
+            raise ReplayError("Not a replay file")
+        if len(data) < 37:
+            raise ReplayError("Replay is cut off")
+        difficulty = data[4]
+        level = data[5:37]
+        nframes, i = read_varint(data, 37)
+        if nframes > MAX_REPLAY_FRAMES:
+            raise ReplayError(f"Replay is longer than {MAX_REPLAY_FRAMES} frames")
+
+        inputs = bytearray()
+        while i < len(data):
+            buttons = data[i]
+            run, i = read_varint(data, i + 1)
+            # checked before the run is expanded, so with nframes capped above a run can't take
+            # more than MAX_REPLAY_FRAMES bytes
+            if len(inputs) + run > nframes:
+                raise ReplayError(f"Replay has more than the {nframes} frames expected")
+            inputs += bytes((buttons,)) * run
+
+        if len(inputs) != nframes:
+            raise ReplayError(f"Replay has {len(inputs)} frames, expected {nframes}")
+        return cls(difficulty, level, bytes(inputs))
+
+    def save(self, filename: str) -> None:
+        """Writes the replay to a file"""
+        with open(filename, "wb") as file:
+            file.write(self.to_bytes())
+
+    @classmethod
+    def load(cls, filename: str) -> Replay:
+        """Reads a replay from a file"""
+        with open(filename, "rb") as file:
+            return cls.from_bytes(file.read())
+
+def write_varint(data: bytearray, n: int) -> None:
+    """Appends an unsigned int to data, 7 bits per byte"""
+    while n >= 0x80:
+        data.append(n & 0x7f | 0x80)
+        n >>= 7
+    data.append(n)
+
+def read_varint(data: bytes, i: int) -> tuple[int, int]:
+    """Reads an unsigned int written by write_varint, returns it and the next index"""
+    n = shift = 0
+    while True:
+        if i >= len(data):
+            raise ReplayError("Replay is cut off")
+        byte = data[i]
+        n |= (byte & 0x7f) << shift
+        shift += 7
+        i += 1
+        if byte < 0x80:
+            return n, i
+        if shift > 63: # no count in a replay is that big, and longer ones get slow to build
+            raise ReplayError("Replay has a number too large")
+
+def verify_replay(replay: Replay, resource: str = RESOURCE_FILE) -> tuple[bool, int]:
+    """
+    Plays a replay back without a window, as fast as possible
+    Returns whether the run was won and how many frames it took
+    """
+    if not 0 < replay.difficulty <= len(DIFFICULTIES):
+        raise ReplayError(f"Unknown difficulty {replay.difficulty}")
+    if load_level(replay.difficulty, resource).digest != replay.level:
+        raise ReplayError("Replay was recorded on a different level")
+
+    app = App(headless=True, resource=resource)
+    app.difficulty = replay.difficulty
+
+    app.start()
+    for buttons in replay.inputs:
+        app.step(buttons)
+        if app.game_state != PLAYING:
+            break
+
+    if not app.player.win:
+        return False, app.frame_count - app.start_frame
+    return len(replay) == app.end_frame - app.start_frame, app.end_frame - app.start_frame
+
+
+# region Profiler
+class Profiler:
+    """
+    Times the phases of every frame, the last PROFILE_FRAMES frames are kept in a ring buffer
+    Call begin() at the start of a frame, lap() after each phase and end() when it is drawn
+    """
+    def __init__(self, filename: str = PROFILE_FILE, size: int = PROFILE_FRAMES):
+        self.filename: str = filename
+        self.size: int = size
+        self.samples: dict[str, array] = {
+            phase: array("d", bytes(8 * size)) for phase in PROFILE_PHASES
+        }
+        self.starts: array = array("d", bytes(8 * size)) # perf_counter() at each frame's start
+        self.index: int = 0 # the slot of the frame being timed
+        self.count: int = 0 # how many slots hold a finished frame
+        self.last: float = time.perf_counter()
+        self.visible: bool = True
+        self.summary: list[tuple[str, float, float]] = []
+
+    def begin(self) -> None:
+        """Starts timing a frame"""
+        self.last = self.starts[self.index] = time.perf_counter()
+        for samples in self.samples.values():
+            samples[self.index] = 0.0
+
+    def lap(self, phase: str) -> None:
+        """Adds the time since the last lap to a phase of this frame"""
+        now = time.perf_counter()
+        self.samples[phase][self.index] += now - self.last
+        self.last = now
+
+    def end(self, keep: bool = True) -> None:
+        """
+        Finishes the frame, the slot it used is reused PROFILE_FRAMES frames later
+        With keep=False the frame is dropped and its slot is used again by the next one
+        """
+        if not keep:
+            return
+        self.index = (self.index + 1) % self.size
+        self.count = min(self.count + 1, self.size)
+        if self.index % 30 == 0:
+            self.summary = self.stats()
+
+    def frames(self) -> list[int]:
+        """Returns the slots of the kept frames, oldest first"""
+        first = (self.index - self.count) % self.size
+        return [(first + i) % self.size for i in range(self.count)]
+
+    def stats(self) -> list[tuple[str, float, float]]:
+        """Returns the average and 99th percentile of each phase in milliseconds"""
+        slots = self.frames()
+        if not slots:
+            return []
+        stats = []
+        for phase, samples in self.samples.items():
+            times = sorted(samples[i] for i in slots)
+            stats.append((
+                phase,
+                sum(times) / len(times) * 1000,
+                times[min(len(times) - 1, len(times) * 99 // 100)] * 1000
+            ))
+        return stats
+
+    def draw(self, status: str = "") -> None:
+        """Draws the average and 99th percentile of each phase over the game, then the status"""
+        if not self.visible:
+            return
+        pyxel.camera()
+        pyxel.rect(0, 0, 128, 14 + 6 * len(self.summary), 0)
+        pyxel.text(1, 1, "phase         avg ms  p99 ms", 7)
+        for i, (phase, average, p99) in enumerate(self.summary):
+            pyxel.text(1, 8 + 6 * i, f"{phase:<12}{average:>8.3f}{p99:>8.3f}", 7)
+        pyxel.text(1, 8 + 6 * len(self.summary), status, 7)
+
+    def dump(self) -> None:
+        """Writes the kept frames to the file, as CSV or as a Chrome trace depending on its name"""
+        slots = self.frames()
+        try:
+            with open(self.filename, "w", newline="", encoding="utf-8") as file:
+                if self.filename.endswith(".csv"):
+                    file.write(",".join(("start", *PROFILE_PHASES)) + "\n")
+                    for i in slots:
+                        file.write(",".join(
+                            (f"{self.starts[i]:.6f}",
+                             *(f"{self.samples[phase][i]:.6f}" for phase in PROFILE_PHASES))
+                        ) + "\n")
+                    return
+
+                # chrome://tracing and Perfetto only get durations, so the phases of a frame
+                # are laid end to end from its start
+                events = []
+                for i in slots:
+                    start = self.starts[i] * 1e6
+                    for phase in PROFILE_PHASES:
+                        duration = self.samples[phase][i] * 1e6
+                        events.append({
+                            "name": phase, "ph": "X", "ts": start, "dur": duration,
+                            "pid": 0, "tid": 0
+                        })
+                        start += duration
+                json.dump({"traceEvents": events}, file)
+        except OSError: # the web build can't always write files
+            pass
+
+
+class NoProfiler:
+    """Stands in for Profiler when profiling is off, so the game doesn't check every phase"""
+    visible: bool = False
+
+    def begin(self) -> None:
+        """Does nothing"""
+
+    def lap(self, phase: str) -> None:
+        """Does nothing"""
+
+    def end(self, keep: bool = True) -> None:
+        """Does nothing"""
+
+    def draw(self, status: str = "") -> None:
+        """Does nothing"""
+
+
+# region Splits
+class Splits:
+    """
+    Times a run room by room, in frames and in real time, with the deaths and slow frames in each
+    A split starts every time the camera moves to another room, going back to one included
+    """
+    def __init__(self, difficulty: int, frame: int, clock: Clock):
+        self.difficulty: int = difficulty
+        self.clock: Clock = clock
+        self.start_frame: int = frame
+        self.start_time: float = time.perf_counter()
+        self.splits: list[dict[str, Any]] = []
+        # when the current split started, and the clock's counters then
+        self.split_time: float = self.start_time
+        self.lag_frames: int = clock.lag_frames
+        self.skipped_ticks: int = clock.skipped_ticks
+        self.end_frame: int = frame
+        self.end_time: float = self.start_time
+
+    def enter(self, room: int, frame: int) -> None:
+        """Ends the current split and starts one for the room"""
+        self.end(frame)
+        self.splits.append({
+            "room": room,
+            "start": frame - self.start_frame, # frames since the start of the run
+            "frames": 0,
+            "seconds": 0.0, # real time, frames / TICK_RATE is the game time
+            "deaths": 0,
+            "slow_frames": 0, # frames whose update and render took longer than FRAME_BUDGET
+            "worst_ms": 0.0,
+            "lag": 0, # renders that needed extra updates, see Clock
+            "skipped": 0,
+        })
+        self.split_time = self.end_time
+        self.lag_frames = self.clock.lag_frames
+        self.skipped_ticks = self.clock.skipped_ticks
+
+    def end(self, frame: int) -> None:
+        """Fills in the frames and times of the current split up to now"""
+        self.end_frame = frame
+        self.end_time = time.perf_counter()
+        if not self.splits:
+            return
+        split = self.splits[-1]
+        split["frames"] = frame - self.start_frame - split["start"]
+        split["seconds"] = self.end_time - self.split_time
+        split["lag"] = self.clock.lag_frames - self.lag_frames
+        split["skipped"] = self.clock.skipped_ticks - self.skipped_ticks
+
+    def death(self) -> None:
+        """Counts a death in the current split"""
+        self.splits[-1]["deaths"] += 1
+
+    def frame_time(self, seconds: float) -> None:
+        """Records how long a frame's update and render took"""
+        split = self.splits[-1]
+        split["worst_ms"] = max(split["worst_ms"], seconds * 1000)
+        if seconds > FRAME_BUDGET:
+            split["slow_frames"] += 1
+
+    def to_json(self, won: bool) -> dict[str, Any]:
+        """Returns the run and its splits as a dict for json.dump(), call end() first"""
+        frames = self.end_frame - self.start_frame
+        return {
+            "difficulty": DIFFICULTIES[self.difficulty - 1],
+            "won": won,
+            "frames": frames,
+            "game_seconds": frames / TICK_RATE,
+            "real_seconds": self.end_time - self.start_time,
+            "deaths": sum(split["deaths"] for split in self.splits),
+            "slow_frames": sum(split["slow_frames"] for split in self.splits),
+            "splits": self.splits,
+        }
+
+    def save(self, filename: str, won: bool) -> None:
+        """Writes the run to a json file"""
+        with open(filename, "w", encoding="utf-8") as file:
+            json.dump(self.to_json(won), file, indent=2)
+
+
+# region Rewind
+class Rewind:
+    """
+    The last frames of a run in ring buffers made once, so recording a frame is a few writes
+    Each frame keeps the player, the camera and the spawn, and the slot of the state of the
+    camera's room, which is only written again on the frames it could have changed
+    """
+    def __init__(self, size: int = REWIND_FRAMES):
+        self.size: int = size
+        # one array per field, indexed by the frame's slot
+        self.x: array = array("i", bytes(4 * size))
+        self.y: array = array("i", bytes(4 * size))
+        self.jumping: array = array("i", bytes(4 * size))
+        self.dir: array = array("b", bytes(size))
+        self.camera: array = array("i", bytes(4 * size))
+        self.spawn_x: array = array("i", bytes(4 * size))
+        self.spawn_y: array = array("i", bytes(4 * size))
+        self.room: array = array("i", bytes(4 * size)) # the slot of the frame's room state
+        self.rooms: array = array("i", bytes(4 * size * REWIND_ROOM)) # room states, back to back
+
+        self.head: int = 0 # the slot the next frame goes in
+        self.count: int = 0 # frames kept, up to size
+        self.room_head: int = 0 # the slot the next room state goes in
+
+    def clear(self) -> None:
+        """Forgets every frame"""
+        self.head = self.count = self.room_head = 0
+
+    def record(self, app: App, changed: bool) -> None:
+        """
+        Keeps the frame that just ended, over the oldest one when full
+        changed says if the room's keys, buttons or doors could have changed during it
+        """
+        head = self.head
+        if changed or not self.count:
+            # a room state is written at most once a frame, so size slots are enough for every frame
+            self.room[head] = self.room_head
+            rooms = self.rooms
+            j = self.room_head * REWIND_ROOM
+            for keys in app.keys[app.camera].values():
+                rooms[j] = keys.state
+                j += 1
+            for buttons in app.buttons[app.camera].values():
+                rooms[j] = buttons.state
+                j += 1
+            for doors in app.doors[app.camera].values():
+                rooms[j] = doors.state
+                rooms[j + 1] = doors.timer
+                rooms[j + 2] = doors.animation_state
+                j += 3
+            self.room_head = (self.room_head + 1) % self.size
+        else:
+            self.room[head] = self.room[head - 1] # the frame before's, slot -1 wraps to the last
+
+        player = app.player
+        self.x[head] = player.x
+        self.y[head] = player.y
+        self.jumping[head] = player.jumping
+        self.dir[head] = player.sprite.dir
+        self.camera[head] = app.camera
+        self.spawn_x[head], self.spawn_y[head] = app.spawn
+        # counted up in place, a % would hold one more int above 256 at once, see audit.py
+        self.head += 1
+        if self.head == self.size:
+            self.head = 0
+        if self.count < self.size:
+            self.count += 1
+
+    def back(self) -> int | None:
+        """
+        Drops the last frame, returns the slot of the one before it,
+        or None if there is only one frame left
+        """
+        if self.count < 2:
+            return None
+        self.count -= 1
+        self.head = (self.head - 1) % self.size
+        slot = (self.head - 1) % self.size
+        # the room states written after this frame belong to the frames dropped
+        self.room_head = (self.room[slot] + 1) % self.size
+        return slot
+
+    def entry(self, room: int) -> int:
+        """Returns the slot of the room's state on the oldest frame kept since the player got in"""
+        slot = (self.head - 1) % self.size
+        for back in range(2, self.count + 1):
+            before = (self.head - back) % self.size
+            if self.camera[before] != room:
+                break
+            slot = before
+        return self.room[slot]
+
+    def room_state(self, slot: int, length: int) -> tuple[int, ...]:
+        """Returns a room state written by record(), like App.room_state()"""
+        return tuple(self.rooms[slot * REWIND_ROOM:slot * REWIND_ROOM + length])
+
 
 # region Keys
 class Keys:
     """Handles a set of keys of one type"""
+    __slots__ = ("locations", "state", "sprite", "tile_state")
+
     def __init__(self, sprite: Tile = (0, 0), state: bool = True):
         self.locations: set[Tile] = set()
         self.state: bool = state
         self.sprite: Tile = sprite
+        self.tile_state: bool = state # the state last written to the tilemap
 
     def draw(self) -> None: # Note: this is unused
         """Draws all the keys in this class"""
@@ -85,25 +1252,36 @@ class Keys:
     def __iter__(self): # also unused but i thought it would be convenient
         yield from self.locations
 
-    def collect(self, doors: set[Doors]):
+    def collect(self, doors: dict[Tile, Doors]):
         """Run this method when a key from the set is collected"""
         self.state = False
 
-        for door in doors:
-            door.open_door(self.sprite)
+        # rooms only have the doors they contain, a key can be in a room without its doors
+        if DOOR_OF[self.sprite] in doors:
+            doors[DOOR_OF[self.sprite]].open_door(self.sprite)
+
+    def settled(self) -> bool:
+        """Whether update() has nothing to do"""
+        return self.state == self.tile_state
+
+    def update(self, tiles: TileGrid):
+        """Handles the keys on the tilemap, only writes to it when the state changed"""
+        if self.state == self.tile_state:
+            return
+        self.tile_state = self.state
 
-    def update(self):
-        """Handles the keys on the tilemap"""
         if self.state:
             for x, y in self.locations:
-                tile_set(x, y, self.sprite)
+                tiles.pset(x, y, self.sprite)
         else:
             for x, y in self.locations:
-                tile_set(x, y, EMPTY_TILE)
+                tiles.pset(x, y, EMPTY_TILE)
 
 # region Buttons
 class Buttons:
     """Handles a set of buttons of one type"""
+    __slots__ = ("sprite", "locations", "state")
+
     def __init__(self, sprite: Tile, state: int = 0):
         self.sprite: Tile = sprite
         self.locations: set[Tile] = set()
@@ -119,24 +1297,27 @@ class Buttons:
         """Updates the state of the button"""
         self.state = max(0, self.state - 1)
 
-    def press(self, x: int, y: int, doors: set[Doors]) -> None:
-        """Run when player is on a button to set the state"""
-        for button in self.locations:
-            if button[0] * 8 - 4 <= x <= button[0] * 8 + 4 and button[1] * 8 == y:
-                self.state = 150
-            elif (
-                button[0] * 8 - 5 <= x <= button[0] * 8 + 5
-                and button[1] * 8 - 1 <= y <= button[1] * 8 and self.state <= 2
-            ):
-                self.state = 2
-            elif (
-                button[0] * 8 - 6 <= x <= button[0] * 8 + 6
-                and button[1] * 8 - 2 < y <= button[1] * 8 and self.state <= 1
-            ):
-                self.state = 1
+    def settled(self) -> bool:
+        """Whether update() has nothing to do"""
+        return not self.state
+
+    def press(self, button: Tile, x: int, y: int, doors: dict[Tile, Doors]) -> None:
+        """Run when player is on the button at the given location to set the state"""
+        if button[0] * 8 - 4 <= x <= button[0] * 8 + 4 and button[1] * 8 == y:
+            self.state = 150
+        elif (
+            button[0] * 8 - 5 <= x <= button[0] * 8 + 5
+            and button[1] * 8 - 1 <= y <= button[1] * 8 and self.state <= 2
+        ):
+            self.state = 2
+        elif (
+            button[0] * 8 - 6 <= x <= button[0] * 8 + 6
+            and button[1] * 8 - 2 < y <= button[1] * 8 and self.state <= 1
+        ):
+            self.state = 1
 
-        for door in doors:
-            door.button_open(self.sprite, self.state)
+        if DOOR_OF[self.sprite] in doors:
+            doors[DOOR_OF[self.sprite]].button_open(self.sprite, self.state)
 
     def draw(self):
         """Draws every button in the set"""
@@ -156,12 +1337,15 @@ class Buttons:
 # region Doors
 class Doors:
     """Handles a set of doors of one type"""
+    __slots__ = ("sprite", "locations", "state", "timer", "animation_state", "tile_closed")
+
     def __init__(self, sprite: Tile, state: bool = True, timer: int = 0):
         self.sprite: Tile = sprite
         self.locations: set[Tile] = set()
         self.state: bool = state
         self.timer: int = timer
         self.animation_state: int = 8
+        self.tile_closed: bool = True # whether the doors are in the tilemap right now
 
     def add(self, tile: Tile) -> None:
         """Add a door tile to the set"""
@@ -169,6 +1353,14 @@ class Doors:
             raise TypeError("Can only add tiles to Doors")
         self.locations.add(tile)
 
+    def settled(self) -> bool:
+        """Whether update() and update_tiles() have nothing to do"""
+        closed = bool(self.state and not self.timer)
+        return (
+            not self.timer and self.animation_state == (8 if closed else 0)
+            and closed == self.tile_closed
+        )
+
     def update(self) -> None:
         """Update the doors"""
         self.timer = max(0, self.timer - 1)
@@ -197,18 +1389,33 @@ class Doors:
             8, self.animation_state
         )
 
+    def update_tiles(self, tiles: TileGrid) -> None:
+        """
+        Sets the doors in the tilemap so they only collide when closed
+        Only writes to the tilemap when the doors open or close
+        """
+        closed = self.state and not self.timer
+        if closed == self.tile_closed:
+            return
+        self.tile_closed = closed
+
+        if closed:
+            for x, y in self.locations:
+                tiles.pset(x, y, self.sprite)
+                tiles.pset(x, y + 1, (self.sprite[0], self.sprite[1] + 1))
+        else:
+            for x, y in self.locations:
+                tiles.pset(x, y, EMPTY_TILE)
+                tiles.pset(x, y + 1, EMPTY_TILE)
+
     def draw(self) -> None:
-        """Draws all of the doors and sets them in the tilemap"""
+        """Draws all of the doors"""
         if self.state and not self.timer:
             for x, y in self.locations:
-                tile_set(x, y, self.sprite)
-                tile_set(x, y + 1, (self.sprite[0], self.sprite[1] + 1))
                 pyxel.blt(x * 8, y * 8, 0, 16, 32, 8, 16)
                 self.draw_animated(x, y)
         else:
             for x, y in self.locations:
-                tile_set(x, y, EMPTY_TILE)
-                tile_set(x, y + 1, EMPTY_TILE)
                 self.draw_animated(x, y)
 
     def open_door(self, key: Tile) -> None:
@@ -242,39 +1449,48 @@ class PlayerSprite:
 # region Player
 class Player:
     """Handles the player"""
-    def __init__(self, spawn: Tile = (0, 0), *, direction: bool = RIGHT):
+    def __init__(
+            self,
+            spawn: Tile,
+            tiles: TileGrid,
+            controls: Controls,
+            *,
+            direction: bool = RIGHT,
+            profiler: Profiler | NoProfiler | None = None
+        ):
+        self.tiles: TileGrid = tiles
+        self.controls: Controls = controls
+        if profiler is None:
+            profiler = NoProfiler()
+        self.profiler: Profiler | NoProfiler = profiler
         self.x: int = spawn[0]
         self.y: int = spawn[1]
         self.jumping: int = 0
         self.dead: bool = False
         self.win = False
+        self.touched: bool = False # whether the player was on a key, button or ship, for App.update
         self.sprite: PlayerSprite = PlayerSprite(direction)
         self.moving: bool = False
 
-    def corners(self) -> tuple[Tile, Tile, Tile, Tile]:
-        """Returns what tiles all four corners of the player are in"""
-        return (
-            tile_at(self.x // 8, self.y // 8),
-            tile_at(self.x // 8, (self.y + 7) // 8),
-            tile_at((self.x + 7) // 8, self.y // 8),
-            tile_at((self.x + 7) // 8, (self.y + 7) // 8)
-        )
-
     # region Player.update_position()
     def update_position(self) -> None:
         """Updates the position of the player"""
-        if (tile_at(self.x // 8, self.y // 8 + 1) not in COLLIDERS
-            and tile_at((self.x + 7) // 8, self.y // 8 + 1) not in COLLIDERS
+        # calling the methods straight away doesn't make a bound method object every frame
+        tiles = self.tiles
+        controls = self.controls
+
+        if (not tiles.flags_at(self.x // 8, self.y // 8 + 1) & COLLIDER
+            and not tiles.flags_at((self.x + 7) // 8, self.y // 8 + 1) & COLLIDER
         ):
             if self.jumping == 0:
                 self.y += 2
 
-        elif pyxel.btn(pyxel.KEY_UP) or pyxel.btn(pyxel.KEY_SPACE):
+        elif controls.btn(BTN_UP) or controls.btn(BTN_SPACE):
             self.jumping = 12
 
         if (
-            tile_at(self.x // 8, (self.y - 1) // 8) in COLLIDERS
-            or tile_at((self.x + 7) // 8, (self.y - 1) // 8) in COLLIDERS
+            tiles.flags_at(self.x // 8, (self.y - 1) // 8) & COLLIDER
+            or tiles.flags_at((self.x + 7) // 8, (self.y - 1) // 8) & COLLIDER
         ):
             self.jumping = 0
 
@@ -283,17 +1499,17 @@ class Player:
             self.y -= 2
 
 
-        if (pyxel.btn(pyxel.KEY_RIGHT)
-            and tile_at(self.x // 8 + 1, self.y // 8) not in COLLIDERS
-            and tile_at(self.x // 8 + 1, (self.y + 7) // 8) not in COLLIDERS
+        if (controls.btn(BTN_RIGHT)
+            and not tiles.flags_at(self.x // 8 + 1, self.y // 8) & COLLIDER
+            and not tiles.flags_at(self.x // 8 + 1, (self.y + 7) // 8) & COLLIDER
         ):
             self.x += 1
             self.sprite.dir = RIGHT
             self.moving = not self.moving
 
-        elif self.x > 0 and pyxel.btn(pyxel.KEY_LEFT) and (
-            tile_at((self.x - 1) // 8, self.y // 8) not in COLLIDERS
-            and tile_at((self.x - 1) // 8, (self.y + 7) // 8) not in COLLIDERS
+        elif self.x > 0 and controls.btn(BTN_LEFT) and (
+            not tiles.flags_at((self.x - 1) // 8, self.y // 8) & COLLIDER
+            and not tiles.flags_at((self.x - 1) // 8, (self.y + 7) // 8) & COLLIDER
         ):
             self.x -= 1
             self.sprite.dir = LEFT
@@ -308,37 +1524,59 @@ class Player:
             spawn: Tile = (0, 0),
             keys: dict[Tile, Keys] | None = None,
             buttons: dict[Tile, Buttons] | None = None,
-            doors: set[Doors] | None = None
+            doors: dict[Tile, Doors] | None = None
         ) -> None:
-        """Updates the player"""
+        """
+        Updates the player
+        keys and doors are the room's dicts by sprite, buttons is the room's dict by location
+        """
         if keys is None:
             keys = {}
         if buttons is None:
             buttons = {}
         if doors is None:
-            doors = set()
+            doors = {}
 
         self.update_position()
-
-        corners = self.corners()
-        # print(corners)
+        self.profiler.lap("position")
+
+        # the tiles under the 4 corners of the player, without making tuples every frame
+        left, right = self.x // 8, (self.x + 7) // 8
+        top, bottom = self.y // 8, (self.y + 7) // 8
+        top_left = self.tiles.id_at(left, top)
+        bottom_left = self.tiles.id_at(left, bottom)
+        top_right = self.tiles.id_at(right, top)
+        bottom_right = self.tiles.id_at(right, bottom)
+        flags = (
+            TILE_FLAGS[top_left] | TILE_FLAGS[bottom_left]
+            | TILE_FLAGS[top_right] | TILE_FLAGS[bottom_right]
+        )
 
         self.sprite.update(self.moving, self.jumping)
 
 
-        if pyxel.btn(pyxel.KEY_R) or any((tile in FIRES for tile in corners)):
+        if self.controls.btn(BTN_R) or flags & FIRE:
             self.dead = True
             self.x, self.y = spawn
             self.jumping = 0
             self.sprite.dir = RIGHT
 
-        for corner in corners:
-            if corner in KEYS:
-                keys[corner].collect(doors)
-            elif corner in BUTTONS:
-                buttons[corner].press(self.x, self.y, doors)
-            elif corner in END_SHIP:
-                self.win = True
+        if flags & (KEY | BUTTON | SHIP):
+            self.touched = True
+            for corner, tile in (
+                ((left, top), top_left), ((left, bottom), bottom_left),
+                ((right, top), top_right), ((right, bottom), bottom_right)
+            ):
+                flags = TILE_FLAGS[tile]
+                # keys and buttons are only the camera's room,
+                # the player can reach into the next one
+                if flags & KEY and id_tile(tile) in keys:
+                    keys[id_tile(tile)].collect(doors)
+                elif flags & BUTTON and corner in buttons:
+                    buttons[corner].press(corner, self.x, self.y, doors)
+                elif flags & SHIP:
+                    self.win = True
+        self.profiler.lap("pickups")
 
     def draw(self) -> None:
         """Draws the player"""
@@ -347,16 +1585,50 @@ class Player:
 
 # region App
 class App:
-    """The main app itself"""
-    def __init__(self):
+    """
+    The main app itself
+    With headless=True no window is opened, drive it by calling step() once per frame
+    """
+    def __init__(self, *, headless: bool = False, resource: str = RESOURCE_FILE):
+        self.headless: bool = headless
         self.difficulty: int = 1
         self.spawn: Tile = (0, 0)
-
-        self.keys: list[dict[Tile, Keys]]
-        self.buttons: list[dict[Tile, Buttons]]
-        self.doors: list[dict[Tile, Doors]]
+        self.frame_count: int = 0
+
+        self.resource: str = resource
+        self.controls: Controls = Controls()
+        self.recording: bytearray = bytearray(RECORDING_FRAMES) # the inputs of the run so far
+        self.recorded: int = 0 # how many frames of recording are used
+        self.replay: Replay
+        self.history: Rewind = Rewind() # the last frames played, for rewind()
+        self.practice: bool = False # whether the run was rewound, so its time doesn't count
+        self.level: Level | StreamedLevel
+        self.tiles: RoomTiles
+
+        # how often save_state and load_state ran and how long they took in total (seconds)
+        self.state_counters: dict[str, float] = {
+            "saves": 0, "save_time": 0.0, "loads": 0, "load_time": 0.0
+        }
+
+        self.clock: Clock = Clock()
+        self.frame_start: float = 0.0 # perf_counter() when the frame being run started
+        self.splits: Splits # the timing of the current run
+        self.profiler: Profiler | NoProfiler = NoProfiler()
+        if environ.get(PROFILE_ENV):
+            self.start_profiler(environ[PROFILE_ENV])
+        self.watcher: LevelWatcher | None = None
+        self.prefetch: Prefetch | None = None # loading the levels while the menu is up
+        if environ.get(WATCH_ENV) and not headless:
+            self.watcher = LevelWatcher(resource)
+
+        # the entities of the rooms loaded by stream_rooms(), by room
+        self.keys: dict[int, dict[Tile, Keys]]
+        self.buttons: dict[int, dict[Tile, Buttons]]
+        self.doors: dict[int, dict[Tile, Doors]]
+        self.button_at: dict[int, dict[Tile, Buttons]]
         self.player: Player
         self.camera: int
+        self.settled: bool = False # whether the camera's room has nothing to update, see update()
 
         self.game_state: int = MENU
 
@@ -367,40 +1639,255 @@ class App:
         ]
 
         self.difficulty_menu: list[tuple[str, Callable]] = [
-            ("Easy", self.change_difficulty),
-            ("Normal", self.change_difficulty),
-            ("Hard", self.change_difficulty),
-            ("Lunatic", self.change_difficulty),
+            *((name, self.change_difficulty) for name in DIFFICULTIES),
             ("Back", self.difficulty_back)
         ]
 
         self.selected_option: int = 0
         self.current_menu: list[tuple] = self.default_menu
 
-        pyxel.run(self.update, self.draw)
+        # the menu and end screen are composed into an image, and only drawn again when they change
+        self.screen: Any = None # the pyxel.Image, made on the first draw
+        self.screen_key: tuple | None = None # what the image shows, see draw_screen
+        self.screen_shown: bool = False # whether the window shows the image, untouched since
+
+        # seconds each part of the startup took, first_frame is from the import to the first draw
+        self.startup: dict[str, float] = {"import": IMPORT_TIME}
+
+        if headless:
+            return
+
+        start = time.perf_counter()
+        pyxel.init(128, 128, title="SpaceWarp", fps=TICK_RATE)
+        self.startup["window"] = time.perf_counter() - start
+        start = time.perf_counter()
+        pyxel.load(resource)
+        self.startup["assets"] = time.perf_counter() - start
+        self.prefetch_levels()
+        pyxel.run(self.frame, self.draw)
+
+    def frame(self) -> None:
+        """
+        Reads the keyboard and updates the game, this is what pyxel runs every frame
+        pyxel calls it TICK_RATE times a second and catches up after a slow render by itself
+        """
+        self.frame_start = time.perf_counter()
+        if pyxel.btnp(pyxel.KEY_F1):
+            self.toggle_profiler()
+        self.profiler.begin()
+        self.tick(
+            read_buttons(), self.game_state == PLAYING and pyxel.btn(getattr(pyxel, REWIND_KEY))
+        )
+        if self.watcher is not None:
+            self.watch()
+
+    def tick(self, buttons: int, rewinding: bool = False) -> None:
+        """Runs the one update of a pyxel frame with the buttons read, or goes back a frame"""
+        self.clock.update()
+        if rewinding:
+            self.rewind()
+        else:
+            self.step(buttons)
+
+    def watch(self) -> None:
+        """Reloads the rooms of the level being played that changed in the .pyxres file"""
+        tilemaps = self.watcher.poll()
+        if tilemaps is None:
+            return
+        if self.game_state != PLAYING: # start() loads the new level anyway
+            self.watcher.tilemaps = tilemaps
+            # but the tiles drawn come from pyxel, they have to match the ones collided with
+            if not self.headless:
+                pyxel.load(self.resource)
+            self.screen_key = None
+            if self.game_state == MENU:
+                self.prefetch_levels() # the levels loaded so far are the old file's
+            return
+
+        start = time.perf_counter()
+        try:
+            level, rooms = reload_level(
+                self.level, self.difficulty, self.watcher.tilemaps, tilemaps
+            )
+        except TileError as error: # keep playing the old rooms until the level is fixed
+            print(f"reload: {error}", file=sys.stderr)
+            return
+        self.watcher.tilemaps = tilemaps
+        LEVEL_CACHE[(self.watcher.digest, self.difficulty)] = level
+        if not self.headless:
+            pyxel.load(self.resource)
+        self.screen_key = None
+        self.swap_level(level, rooms)
+        print(
+            f"reload: {self.nrooms} rooms, changed: {', '.join(map(str, rooms)) or 'none'}, "
+            f"{(time.perf_counter() - start) * 1000:.1f} ms",
+            file=sys.stderr
+        )
+
+    def swap_level(self, level: Level | StreamedLevel, rooms: list[int]) -> None:
+        """
+        Plays a new version of the level from where the player is, the rooms listed are new
+        and start over, the others keep the state of their keys, buttons and doors
+        """
+        if self.camera >= level.nrooms: # the player's room is gone
+            self.start(level)
+            return
+
+        resized = level.nrooms != self.nrooms
+        self.level = level
+        self.nrooms = level.nrooms
+        if resized:
+            self.tiles = RoomTiles(self.nrooms)
+            self.player.tiles = self.tiles
+
+        for room in list(self.keys):
+            if resized or room in rooms:
+                self.unload_room(room)
+        for room in rooms:
+            self.room_states.pop(room, None)
+        for room in [room for room in self.room_states if room >= self.nrooms]:
+            del self.room_states[room]
+        self.stream_rooms()
+        if self.saved_room in rooms:
+            self.save_state()
+        self.history.clear() # the frames kept may point at rooms that changed
+
+    def start_profiler(self, filename: str = PROFILE_FILE) -> None:
+        """Starts profiling every frame, the samples are written to the file on exit"""
+        if filename == "1":
+            filename = PROFILE_FILE
+        self.profiler = Profiler(filename)
+        if hasattr(self, "player"):
+            self.player.profiler = self.profiler
+        atexit.register(self.profiler.dump)
+
+    def toggle_profiler(self) -> None:
+        """Shows or hides the profiler, starting it the first time"""
+        if isinstance(self.profiler, NoProfiler):
+            self.start_profiler()
+        else:
+            self.profiler.visible = not self.profiler.visible
+        self.screen_shown = False # so a hidden profiler isn't left on the menu or end screen
+
+    def step(self, buttons: int) -> None:
+        """Updates the game by one frame with the given BTN_ flags held"""
+        if self.game_state == PLAYING:
+            # writing into room made beforehand, appending would reallocate every few frames
+            if self.recorded == len(self.recording):
+                self.recording.extend(bytes(len(self.recording)))
+            self.recording[self.recorded] = buttons
+            self.recorded += 1
+        self.controls.feed(buttons)
+        self.update()
+
+    def rewind(self) -> bool:
+        """
+        Puts the game back one frame, returns false when there are no more frames to go back to
+        A run that was rewound is practice, it isn't saved as a replay or splits
+        """
+        history = self.history
+        slot = history.back()
+        if slot is None:
+            return False
+        self.practice = True
+        player = self.player
+        player.x, player.y = history.x[slot], history.y[slot]
+        player.jumping = history.jumping[slot]
+        player.sprite.dir = bool(history.dir[slot])
+        self.spawn = (history.spawn_x[slot], history.spawn_y[slot])
+
+        camera = history.camera[slot]
+        if camera != self.camera:
+            self.camera = camera
+            self.stream_rooms()
+        length = len(self.room_state(camera))
+        if camera != self.saved_room:
+            # a death goes back to the room as it was when the player got in, or as far back as kept
+            self.set_room_state(camera, history.room_state(history.entry(camera), length))
+            self.save_state()
+
+        self.set_room_state(camera, history.room_state(history.room[slot], length))
+        for keys in self.keys[camera].values():
+            keys.update(self.tiles)
+        for doors in self.doors[camera].values():
+            doors.update_tiles(self.tiles)
+        return True
+
+    def room_state(self, room: int) -> tuple[int, ...]:
+        """Returns the state of the keys, buttons and doors of a room as one flat tuple"""
+        state: list[int] = []
+        for keys in self.keys[room].values():
+            state.append(keys.state)
+        for buttons in self.buttons[room].values():
+            state.append(buttons.state)
+        for doors in self.doors[room].values():
+            state += (doors.state, doors.timer, doors.animation_state)
+        return tuple(state)
+
+    def set_room_state(self, room: int, state: tuple[int, ...]) -> None:
+        """Sets the keys, buttons and doors of a room back to a state from room_state"""
+        self.settled = False
+        values = iter(state)
+        for keys in self.keys[room].values():
+            keys.state = next(values)
+        for buttons in self.buttons[room].values():
+            buttons.state = next(values)
+        for doors in self.doors[room].values():
+            doors.state, doors.timer, doors.animation_state = next(values), next(values), next(values)
+
+    def room_settled(self, room: int) -> bool:
+        """Whether the keys, buttons and doors of a room would stay the same if they were updated"""
+        # plain loops, all() of a generator would allocate one every frame a room is busy
+        for keys in self.keys[room].values():
+            if not keys.settled():
+                return False
+        for buttons in self.buttons[room].values():
+            if not buttons.settled():
+                return False
+        for doors in self.doors[room].values():
+            if not doors.settled():
+                return False
+        return True
 
     def save_state(self) -> None:
-        """Saves the current state of the game"""
-        self.saved_state = deepcopy((self.keys, self.buttons, self.doors))
+        """
+        Saves the state of the keys, buttons and doors of the current room
+        The player can only change the room they are in, so the other rooms don't need saving
+        """
+        start = time.perf_counter()
+        self.saved_room: int = self.camera
+        self.saved_state: tuple[int, ...] = self.room_state(self.camera)
+        self.state_counters["saves"] += 1
+        self.state_counters["save_time"] += time.perf_counter() - start
 
     def load_state(self) -> None:
-        """Loads the current state of the game"""
-        self.keys, self.buttons, self.doors = deepcopy(self.saved_state)
+        """Loads the state saved by save_state back into the room's keys, buttons and doors"""
+        start = time.perf_counter()
+        self.set_room_state(self.saved_room, self.saved_state)
+        self.state_counters["loads"] += 1
+        self.state_counters["load_time"] += time.perf_counter() - start
 
     # region App.update()
     def update(self) -> None:
         """Updates the game"""
+        self.frame_count += 1
+
         if self.game_state == END:
-            if pyxel.btn(pyxel.KEY_RETURN):
+            if self.controls.btn(BTN_RETURN):
                 self.game_state = MENU
+                self.prefetch_levels()
             return
 
         if self.game_state == MENU:
             self.update_menu()
             return
 
-        if pyxel.btnp(pyxel.KEY_Q):
+        if self.controls.btnp(BTN_Q):
             self.game_state = MENU
+            self.prefetch_levels()
+            self.splits.end(self.frame_count)
+            self.save_splits(won=False)
+            return
 
         if self.camera != (self.player.x + 4) // 128:
             self.spawn = (
@@ -408,141 +1895,273 @@ class App:
                 self.player.y
             )
             self.camera = (self.player.x + 4) // 128
+            self.settled = False
+            self.splits.enter(self.camera, self.frame_count)
+            self.stream_rooms()
             self.save_state()
+            self.profiler.lap("save_state")
 
         self.player.update(
             self.spawn,
             self.keys[self.camera],
-            self.buttons[self.camera],
-            set(self.doors[self.camera].values())
+            self.button_at[self.camera],
+            self.doors[self.camera]
         )
 
         if self.player.dead:
             self.load_state()
+            self.splits.death()
             self.player.dead = False
+            self.profiler.lap("load_state")
 
-        for doors in self.doors[self.camera].values():
-            doors.update()
+        if self.player.touched:
+            self.player.touched = False
+            self.settled = False
 
-        for buttons in self.buttons[self.camera].values():
-            buttons.update()
+        # once nothing in the room is counting down or animating, updating it changes nothing
+        changed = not self.settled
+        if changed:
+            for doors in self.doors[self.camera].values():
+                doors.update()
+            self.profiler.lap("doors")
+
+            for buttons in self.buttons[self.camera].values():
+                buttons.update()
+            self.profiler.lap("buttons")
+
+            for keys in self.keys[self.camera].values():
+                keys.update(self.tiles)
+            self.profiler.lap("keys")
+
+            for doors in self.doors[self.camera].values():
+                doors.update_tiles(self.tiles)
+            self.profiler.lap("doors")
 
-        for keys in self.keys[self.camera].values():
-            keys.update()
+            self.settled = self.room_settled(self.camera)
+        self.history.record(self, changed)
 
         if self.player.win:
-            self.end_frame = pyxel.frame_count
+            self.end_frame = self.frame_count
             self.total_time = (self.end_frame - self.start_frame) / 30
             self.game_state = END
+            self.save_replay()
+            self.splits.end(self.frame_count)
+            self.save_splits(won=True)
 
     def draw(self) -> None:
         """Draws the game"""
         if self.game_state == MENU:
             self.draw_menu()
-            return
+        elif self.game_state == END and self.ship_gone():
+            self.draw_end_screen()
+        else:
+            self.draw_game()
+        self.clock.render()
+        # the menu and end screen run none of the phases, they would only pull the stats down
+        self.profiler.end(self.game_state == PLAYING)
+        self.profiler.draw(f"lag {self.clock.lag_frames} skipped {self.clock.skipped_ticks}")
+        if self.game_state == PLAYING:
+            self.splits.frame_time(time.perf_counter() - self.frame_start)
+        if "first_frame" not in self.startup:
+            self.report_startup()
+
+    def report_startup(self) -> None:
+        """Records the time to the first frame, and prints the startup times if asked to"""
+        self.startup["first_frame"] = time.perf_counter() - IMPORT_START
+        if environ.get(STARTUP_ENV):
+            print(
+                "startup: " + ", ".join(
+                    f"{part.replace('_', ' ')} {seconds * 1000:.1f} ms"
+                    for part, seconds in self.startup.items()
+                ),
+                file=sys.stderr
+            )
 
+    def draw_game(self) -> None:
+        """Draws the room the player is in"""
+        self.screen_shown = False
         pyxel.camera(self.camera * 128, 0)
-        pyxel.bltm(0, 0, self.difficulty, 0, 0, self.nrooms * 128, 128)
+        self.draw_room()
+        self.profiler.lap("draw_room")
         for doors in self.doors[self.camera].values():
             doors.draw()
+        self.profiler.lap("draw_doors")
         for buttons in self.buttons[self.camera].values():
             buttons.draw()
+        self.profiler.lap("draw_buttons")
 
         if self.game_state == END:
             self.draw_end()
             return
         self.player.draw()
+        self.profiler.lap("draw_player")
+
+    def draw_room(self) -> None:
+        """
+        Draws the background of the room the camera is in, the camera only ever shows one room
+        Each room is rendered to its own image the first time it is shown and reused after that
+        """
+        if self.camera not in self.backgrounds:
+            background = pyxel.Image(128, 128)
+            background.bltm(
+                0, 0,
+                LEVEL_TILEMAPS[self.difficulty][self.camera // 16],
+                self.camera % 16 * 128, 0,
+                128, 128
+            )
+            self.backgrounds[self.camera] = background
+        pyxel.blt(self.camera * 128, 0, self.backgrounds[self.camera], 0, 0, 128, 128)
+
+    def save_replay(self) -> None:
+        """Keeps the replay of the run that just ended, and writes it to REPLAY_DIR"""
+        if self.practice: # the inputs of a rewound run don't play it back
+            return
+        if self.recorded > MAX_REPLAY_FRAMES: # Replay.load would refuse it
+            return
+        self.replay = Replay(
+            self.difficulty,
+            self.level.digest,
+            bytes(self.recording[:self.recorded])
+        )
+        if self.headless:
+            return
+
+        name = DIFFICULTIES[self.difficulty - 1]
+        try:
+            makedirs(REPLAY_DIR, exist_ok=True)
+            self.replay.save(
+                path.join(REPLAY_DIR, f"{time.strftime('%Y%m%d-%H%M%S')}-{name}.swr")
+            )
+        except OSError: # the web build can't always write files, the run still counts
+            pass
+
+    def save_splits(self, won: bool) -> None:
+        """Writes the splits of the run that just ended to SPLITS_DIR"""
+        if self.headless or self.practice:
+            return
 
-    def get_nrooms(self) -> int:
-        """Gets the number of rooms of the current difficulty"""
-        for i in range(1, 16):
-            if tile_at(16*i, 0) == END_TILE:
-                return i
-        return 16
+        name = DIFFICULTIES[self.difficulty - 1]
+        try:
+            makedirs(SPLITS_DIR, exist_ok=True)
+            self.splits.save(
+                path.join(SPLITS_DIR, f"{time.strftime('%Y%m%d-%H%M%S')}-{name}.json"), won
+            )
+        except OSError: # the web build can't always write files
+            pass
 
     # region Menu functions
-    def start(self) -> None:
+    def start(self, level: Level | StreamedLevel | None = None) -> None:
         """
         Sets all of the information needed when the game starts
-        Runs when start button is pressed in the menu
+        Runs when start button is pressed in the menu, level replaces the difficulty's level
         """
-        global tile_at, tile_set
-
-        self.start_frame: int = pyxel.frame_count
+        self.start_frame: int = self.frame_count
         self.end_frame: int
-
-        self.tile_at: Callable = pyxel.tilemaps[self.difficulty].pget
-        self.tile_set: Callable = pyxel.tilemaps[self.difficulty].pset
-
-        self.nrooms: int = self.get_nrooms()
+        self.recorded = 0
+        self.history.clear()
+        self.practice = False
+
+        if self.prefetch is not None:
+            self.prefetch.stop(self.difficulty)
+            self.prefetch = None
+        self.level = level or load_level(self.difficulty, self.resource)
+        self.nrooms: int = self.level.nrooms
+        self.spawn = self.level.spawn
+        self.tiles = RoomTiles(self.nrooms)
+        self.backgrounds: dict[int, Any] = {} # pyxel.Image of each room, see draw_room
 
         # check the start of the __init__ function for the annotations
-        self.keys = [{key : Keys(key) for key in KEYS} for _ in range(self.nrooms)]
-        self.buttons = [
-            {button : Buttons(button) for button in BUTTONS} for _ in range(self.nrooms)
-        ]
-        self.doors = [
-            {door : Doors(door) for door in TOP_DOORS} for _ in range(self.nrooms)
-        ]
+        self.keys = {}
+        self.buttons = {}
+        self.doors = {}
+        self.button_at = {}
+        self.room_states: dict[int, tuple[int, ...]] = {} # room_state() of unloaded rooms
 
-        ship_locations: set[Tile] = set()
-        ship_in_room: bool = False
-
-        for y in range(16):
-            for x in range(self.nrooms * 16):
-                tile = self.tile_at(x, y)
-                if tile in SPAWN_TILE:
-                    self.spawn = x * 8, y * 8
-                    tile = EMPTY_TILE
-
-                elif tile in KEYS:
-                    self.keys[x // 16][tile].add((x, y))
-                    #  tile_set(x, y, EMPTY_TILE)
-
-                elif tile in BUTTONS:
-                    self.buttons[x // 16][tile].add((x, y))
-
-                elif tile in TOP_DOORS:
-                    if y == 16:
-                        raise TileError("Top door cannot be at the bottom of the screen")
-                    if self.tile_at(x, y + 1) in BOTTOM_DOORS:
-                        self.doors[x // 16][tile].add((x, y))
-                    else:
-                        raise TileError(f"Missing bottom door at {(x, y + 1)}")
-
-                elif tile in BOTTOM_DOORS:
-                    if y == 0:
-                        raise TileError("Bottom door cannot be at the top of the screen")
-                    if self.tile_at(x, y - 1) not in TOP_DOORS:
-                        raise TileError(f"Missing top door at {(x, y - 1)}")
-
-                elif tile == END_SHIP_TOP_LEFT:
-                    if ship_in_room:
-                        raise TileError("Cannot have 2 end ships in the same room")
-                    ship_in_room = True
-                    ship_tiles: set[Tile] = {(x + i, y + j) for i in range(2) for j in range(2)}
-                    if any(self.tile_at(*ship_tile) not in END_SHIP for ship_tile in ship_tiles):
-                        raise TileError(f"Incomplete end ship at {x, y}")
-                    for ship_tile in ship_tiles:
-                        ship_locations.add(ship_tile)
-
-                elif tile in END_SHIP and (x, y) not in ship_locations:
-                    raise TileError("Incomplete end ship")
-
-                if x % 16 == 0 and y % 16 == 0:
-                    ship_in_room = False
-
-                tile_set(x, y, tile)
-
-        self.player = Player(self.spawn)
+        self.player = Player(self.spawn, self.tiles, self.controls, profiler=self.profiler)
         self.camera = 0
+        self.splits = Splits(self.difficulty, self.frame_count, self.clock)
+        self.splits.enter(self.camera, self.frame_count)
+        self.stream_rooms()
 
         self.save_state()
         self.game_started: bool = True
         self.game_state = PLAYING
 
+    def prefetch_levels(self) -> None:
+        """
+        Starts loading the levels on a thread, the ones already loaded are skipped right away
+        The web build can't start threads, there start() loads the level like it always did
+        """
+        if self.headless or sys.platform == "emscripten":
+            return
+        if self.prefetch is not None:
+            self.prefetch.stop()
+            self.prefetch = None
+        try:
+            self.prefetch = Prefetch(self.difficulty, self.resource)
+        except RuntimeError: # can't start new thread
+            pass
+
+    def stream_rooms(self) -> None:
+        """
+        Loads the rooms next to the camera and unloads the ones more than STREAM_BEHIND rooms
+        behind it or STREAM_AHEAD ahead, so only a few rooms are in memory however long the level
+        """
+        for room in [
+            room for room in self.keys
+            if not self.camera - STREAM_BEHIND <= room <= self.camera + STREAM_AHEAD
+        ]:
+            self.unload_room(room)
+        last = min(self.nrooms - 1, self.camera + STREAM_AHEAD)
+        for room in range(max(0, self.camera - 1), last + 1):
+            if room not in self.keys:
+                self.load_room(room)
+
+    def load_room(self, room: int) -> None:
+        """
+        Puts a room's tiles in the tilemap and makes its keys, buttons and doors
+        A room only gets the colours it has, so the update loops only go through what is there
+        """
+        data = self.level.room(room)
+        self.tiles.load_room(room, data.tiles)
+        self.keys[room] = {}
+        self.buttons[room] = {}
+        self.doors[room] = {}
+        self.settled = False
+
+        for entities, kind, locations in (
+            (self.keys[room], Keys, data.keys),
+            (self.buttons[room], Buttons, data.buttons),
+            (self.doors[room], Doors, data.doors),
+        ):
+            for x, y in locations:
+                sprite = self.tiles.pget(x, y)
+                if sprite not in entities:
+                    entities[sprite] = kind(sprite)
+                entities[sprite].add((x, y))
+
+        # every button by location, so a press only touches the button under the player
+        self.button_at[room] = {
+            location: buttons
+            for buttons in self.buttons[room].values() for location in buttons.locations
+        }
+
+        if room in self.room_states:
+            self.set_room_state(room, self.room_states.pop(room))
+            for keys in self.keys[room].values():
+                keys.update(self.tiles)
+            for doors in self.doors[room].values():
+                doors.update_tiles(self.tiles)
+
+    def unload_room(self, room: int) -> None:
+        """Lets go of a room, keeping only the state of its entities for when it is loaded again"""
+        self.room_states[room] = self.room_state(room)
+        del self.keys[room], self.buttons[room], self.doors[room], self.button_at[room]
+        self.backgrounds.pop(room, None)
+
     def get_help(self) -> None:
         """Opens the help page"""
+        from webbrowser import open as wb_open
         wb_open("https://github.com/LMacrini/SpaceWarp-Remake/blob/main/README.md")
 
     def menu_difficulty(self) -> None:
@@ -561,40 +2180,64 @@ class App:
 
     def update_menu(self) -> None:
         """Updates the menu"""
-        if pyxel.btnp(pyxel.KEY_DOWN):
+        if self.controls.btnp(BTN_DOWN):
             self.selected_option += 1
-        elif pyxel.btnp(pyxel.KEY_UP):
+        elif self.controls.btnp(BTN_UP):
             self.selected_option -= 1
         self.selected_option %= len(self.current_menu)
 
-        if pyxel.btnp(pyxel.KEY_RETURN):
+        if self.controls.btnp(BTN_RETURN):
             self.current_menu[self.selected_option][1]()
 
+    def draw_screen(self, key: tuple, compose: Callable[[Any], None]) -> None:
+        """
+        Draws a screen that only changes with key, compose(image) draws it into an image
+        It is composed again when key changes, and not drawn at all while the window still shows it
+        """
+        if key != self.screen_key:
+            if self.screen is None:
+                self.screen = pyxel.Image(128, 128)
+            compose(self.screen)
+            self.screen_key = key
+            self.screen_shown = False
+        if self.screen_shown:
+            return
+        pyxel.camera()
+        pyxel.blt(0, 0, self.screen, 0, 0, 128, 128)
+        self.screen_shown = True
+
     def draw_menu(self) -> None:
         """Draws the menu"""
-        pyxel.bltm(0, 0, 0, 0, 0, 128, 128)
+        key = (
+            "menu", self.current_menu is self.difficulty_menu, self.selected_option, self.difficulty
+        )
+        self.draw_screen(key, self.compose_menu)
+
+    def compose_menu(self, image: Any) -> None:
+        """Draws the menu into an image"""
+        image.bltm(0, 0, 0, 0, 0, 128, 128)
         for i, option in enumerate(self.current_menu):
             color = 7
             if self.current_menu == self.difficulty_menu and i + 1 == self.difficulty:
                 color = 5
             if i == self.selected_option:
                 color = 0
-            pyxel.text(42, 8 * (i - ((len(self.current_menu) + 1)/2)) + 72, option[0], color)
+            image.text(42, 8 * (i - ((len(self.current_menu) + 1)/2)) + 72, option[0], color)
+
+    def ship_gone(self) -> bool:
+        """Whether the ship has flown off the screen at the end, so the end screen is up"""
+        return not self.game_started and self.ship[1] * 8 + 24 - self.ship_height <= 0
 
     def draw_end(self) -> None:
         """Draws the end animation and end screen"""
         if self.game_started:
             self.ship_height: int = 0
-            self.ship: Tile
-            for y in range(16):
-                for x in range(16):
-                    if tile_at(x + 16*self.camera, y) == END_SHIP_TOP_LEFT:
-                        self.ship = (x + 16*self.camera, y)
-                        self.clear_rectangle(x + 16*self.camera, y, 2, 2)
+            self.ship: Tile = self.level.room(self.camera).ship
+            self.clear_rectangle(*self.ship, 2, 2)
 
             self.game_started = False
 
-        if self.ship[1] * 8 + 24 - self.ship_height > 0:
+        if not self.ship_gone():
             pyxel.blt(self.ship[0] * 8, self.ship[1] * 8 - self.ship_height, 0, 0, 32, 16, 16, 0)
             pyxel.blt(
                 self.ship[0] * 8 + 4, self.ship[1] * 8 + 16 - self.ship_height,
@@ -605,20 +2248,34 @@ class App:
             )
             self.ship_height += 1
         else:
-            self.camera = 0
-            pyxel.bltm(0, 0, 0, 0, 0, 128, 128)
-            pyxel.text(48, 48, "You win!", 7)
-            pyxel.text(40, 56, f"Time: {round_half_up(self.total_time)}s", 7)
-            pyxel.text(42, 72, "Difficulty:", 7)
-            pyxel.text(48, 80, self.difficulty_menu[self.difficulty - 1][0], 0)
+            self.draw_end_screen()
+
+    def draw_end_screen(self) -> None:
+        """Draws the end screen once the ship is gone"""
+        self.camera = 0
+        self.draw_screen(("end", self.total_time, self.difficulty), self.compose_end)
+
+    def compose_end(self, image: Any) -> None:
+        """Draws the end screen into an image"""
+        image.bltm(0, 0, 0, 0, 0, 128, 128)
+        image.text(48, 48, "You win!", 7)
+        image.text(40, 56, f"Time: {round_half_up(self.total_time)}s", 7)
+        image.text(42, 72, "Difficulty:", 7)
+        image.text(48, 80, DIFFICULTIES[self.difficulty - 1], 0)
 
     def clear_rectangle(self, x: int, y: int, w: int = 1, h: int = 1) -> None:
         """Sets a rectangle in the current tilemap to be empty"""
         for dy in range(h):
             for dx in range(w):
-                tile_set(x + dx, y + dy, EMPTY_TILE)
+                self.tiles.pset(x + dx, y + dy, EMPTY_TILE)
 
 
 
-if __name__ == "__main__":
+IMPORT_TIME: float = time.perf_counter() - IMPORT_START
+
+def main() -> None:
+    """Opens the game window, nothing happens on import so main.py can be used as a library"""
     App()
+
+if __name__ == "__main__":
+    main()
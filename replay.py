@@ -0,0 +1,38 @@
+"""Checks recorded SpaceWarp runs by playing them back without a window"""
+from __future__ import annotations
+from argparse import ArgumentParser
+import sys
+import time
+from main import DIFFICULTIES, Replay, ReplayError, RESOURCE_FILE, verify_replay
+
+
+def main() -> int:
+    """Verifies every replay given on the command line, returns the exit code"""
+    parser = ArgumentParser(description=__doc__)
+    parser.add_argument("replays", nargs="+", help="replay files (.swr)")
+    parser.add_argument("--resource", default=RESOURCE_FILE, help="the .pyxres file to play on")
+    args = parser.parse_args()
+
+    failed = False
+    for filename in args.replays:
+        start = time.perf_counter()
+        try:
+            replay = Replay.load(filename)
+            win, frames = verify_replay(replay, args.resource)
+        except (OSError, ReplayError) as error:
+            print(f"{filename}: error: {error}")
+            failed = True
+            continue
+        elapsed = (time.perf_counter() - start) * 1000
+
+        verdict = "ok" if win else "REJECTED"
+        failed |= not win
+        print(
+            f"{filename}: {verdict} {DIFFICULTIES[replay.difficulty - 1]} "
+            f"{frames} frames ({frames / 30:.2f}s), checked in {elapsed:.1f}ms"
+        )
+    return int(failed)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
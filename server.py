@@ -0,0 +1,207 @@
+"""Verifies SpaceWarp runs for a leaderboard: an HTTP server that plays submitted replays back"""
+from __future__ import annotations
+from argparse import ArgumentParser
+from concurrent.futures import Future, ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from hashlib import sha256
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from threading import Lock
+import json
+import signal
+import sys
+from main import (
+    DIFFICULTIES, RESOURCE_FILE, TICK_RATE, Replay, ReplayError, load_level, verify_replay
+)
+
+MAX_REPLAY: int = 1 << 20 # bytes, a real replay is a few hundred
+CACHE_SIZE: int = 100_000 # verdicts kept, the oldest are forgotten first
+
+
+def warm_up(resource: str) -> None:
+    """Loads every level when a worker starts, so no submission waits for them to be parsed"""
+    for difficulty in range(1, len(DIFFICULTIES) + 1):
+        load_level(difficulty, resource)
+
+
+def check(data: bytes, resource: str) -> dict[str, object]:
+    """
+    Plays a submitted replay back in a worker, returns the verdict
+    Only a bad replay gives an error verdict, anything else is raised to the server
+    """
+    try:
+        # from_bytes rejects a replay longer than MAX_REPLAY_FRAMES before decoding its inputs
+        replay = Replay.from_bytes(data)
+        win, frames = verify_replay(replay, resource)
+    except ReplayError as error:
+        return {"error": str(error)}
+    return {
+        "difficulty": DIFFICULTIES[replay.difficulty - 1],
+        "win": win,
+        "frames": frames,
+        "time": frames / TICK_RATE,
+    }
+
+
+class Verifier:
+    """
+    Hands replays to a pool of worker processes and keeps the verdicts by the hash of the replay,
+    a replay sent again, or while it is still being played, is only played once
+    """
+    def __init__(self, resource: str = RESOURCE_FILE, jobs: int | None = None):
+        self.resource: str = resource
+        self.jobs: int | None = jobs
+        self.pool: ProcessPoolExecutor = self.new_pool()
+        self.verdicts: dict[str, dict[str, object]] = {} # oldest first
+        # the replays being played, with the pool playing them
+        self.pending: dict[str, tuple[Future, ProcessPoolExecutor]] = {}
+        self.lock: Lock = Lock()
+        # starts the workers now, before the server opens its socket, so they don't inherit it
+        self.pool.submit(warm_up, resource).result()
+
+    def new_pool(self) -> ProcessPoolExecutor:
+        """Makes the pool of workers"""
+        return ProcessPoolExecutor(self.jobs, initializer=warm_up, initargs=(self.resource,))
+
+    def replace_pool(self, broken: ProcessPoolExecutor) -> None:
+        """
+        Replaces a pool whose worker died, unless another thread already did
+        A broken pool can't take any more replays, call with the lock held
+        """
+        if self.pool is broken:
+            self.pool = self.new_pool()
+            broken.shutdown(wait=False, cancel_futures=True)
+
+    def submit(self, data: bytes) -> tuple[Future, ProcessPoolExecutor]:
+        """Hands a replay to a worker, returns its future and the pool, call with the lock held"""
+        try:
+            return self.pool.submit(check, data, self.resource), self.pool
+        except BrokenProcessPool:
+            self.replace_pool(self.pool)
+            return self.pool.submit(check, data, self.resource), self.pool
+
+    def cached(self, digest: str) -> dict[str, object] | None:
+        """Returns the verdict of a replay already played, by its hash"""
+        with self.lock:
+            if digest not in self.verdicts:
+                return None
+            self.verdicts[digest] = self.verdicts.pop(digest)
+            return {"hash": digest, **self.verdicts[digest], "cached": True}
+
+    def verify(self, data: bytes) -> dict[str, object]:
+        """
+        Plays a replay in a worker, or returns its verdict if it was played before
+        Raises what went wrong if the worker couldn't play it, that isn't kept
+        """
+        digest = sha256(data).hexdigest()
+        verdict = self.cached(digest)
+        if verdict is not None:
+            return verdict
+
+        with self.lock:
+            pending = self.pending.get(digest)
+            if pending is None:
+                pending = self.pending[digest] = self.submit(data)
+        future, pool = pending
+        try:
+            result = future.result()
+        except BrokenProcessPool: # a worker was killed, the next replays get a new pool
+            with self.lock:
+                self.replace_pool(pool)
+            raise
+        finally:
+            # a failure isn't kept, the same replay sent again is played again
+            with self.lock:
+                if self.pending.get(digest) is pending:
+                    del self.pending[digest]
+
+        with self.lock:
+            self.verdicts[digest] = result
+            if len(self.verdicts) > CACHE_SIZE:
+                del self.verdicts[next(iter(self.verdicts))]
+        return {"hash": digest, **result, "cached": False}
+
+
+class Handler(BaseHTTPRequestHandler):
+    """
+    POST /verify with a .swr file as the body returns the verdict as json,
+    GET /verdict/<hash> returns the verdict of a replay already sent
+    """
+    server: Server
+
+    def do_POST(self) -> None:
+        """Verifies a replay"""
+        if self.path != "/verify":
+            self.reply(404, {"error": "Not found"})
+            return
+        try:
+            length = int(self.headers.get("Content-Length", 0))
+        except ValueError:
+            self.reply(400, {"error": "Content-Length is not a number"})
+            return
+        if not 0 < length <= MAX_REPLAY:
+            self.reply(413, {"error": f"Send a replay of at most {MAX_REPLAY} bytes"})
+            return
+
+        try:
+            verdict = self.server.verifier.verify(self.rfile.read(length))
+        except Exception as error: # the worker died or the level couldn't be loaded
+            self.log_error("verifying failed: %r", error)
+            self.reply(500, {"error": "The replay couldn't be verified, try again later"})
+            return
+        self.reply(400 if "error" in verdict else 200, verdict)
+
+    def do_GET(self) -> None:
+        """Looks up a verdict"""
+        verdict = None
+        if self.path.startswith("/verdict/"):
+            verdict = self.server.verifier.cached(self.path.removeprefix("/verdict/"))
+        if verdict is None:
+            self.reply(404, {"error": "Not found"})
+        else:
+            self.reply(200, verdict)
+
+    def reply(self, status: int, body: dict[str, object]) -> None:
+        """Sends a json response"""
+        data = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+
+class Server(ThreadingHTTPServer):
+    """The HTTP server, each request waits for its verdict in its own thread"""
+    daemon_threads = True
+    request_queue_size = 256 # a burst of submissions waits for a thread instead of being refused
+
+    def __init__(self, address: tuple[str, int], verifier: Verifier):
+        super().__init__(address, Handler)
+        self.verifier: Verifier = verifier
+
+
+def main() -> int:
+    """Runs the server until it is stopped, returns the exit code"""
+    parser = ArgumentParser(description=__doc__)
+    parser.add_argument("resource", nargs="?", default=RESOURCE_FILE, help="the .pyxres file")
+    parser.add_argument("--host", default="127.0.0.1", help="the address to listen on")
+    parser.add_argument("-p", "--port", type=int, default=8000, help="the port to listen on")
+    parser.add_argument("-j", "--jobs", type=int, default=None, help="worker processes")
+    args = parser.parse_args()
+
+    # stopping the server with a signal shuts it down like ctrl+c, the workers included
+    signal.signal(signal.SIGTERM, signal.default_int_handler)
+    verifier = Verifier(args.resource, args.jobs)
+    try:
+        with Server((args.host, args.port), verifier) as server:
+            print(f"verifying replays on http://{args.host}:{args.port}/verify", flush=True)
+            server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        verifier.pool.shutdown(cancel_futures=True)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,313 @@
+"""Searches every room of the SpaceWarp levels to check they can be beaten and find par times"""
+from __future__ import annotations
+from argparse import ArgumentParser
+from concurrent.futures import ProcessPoolExecutor
+from heapq import heappop, heappush
+from os import makedirs, path
+import sys
+from main import (
+    App, BTN_LEFT, BTN_RIGHT, BTN_UP, DIFFICULTIES, END, PLAYING, RESOURCE_FILE, Replay, Tile,
+    verify_replay
+)
+
+# LEFT + RIGHT is the same as RIGHT and SPACE is the same as UP, so these are all the inputs
+ACTIONS: tuple[int, ...] = (
+    BTN_RIGHT, BTN_RIGHT | BTN_UP, BTN_LEFT, BTN_LEFT | BTN_UP, BTN_UP, 0
+)
+
+# the player's x, y and jumping counter, then App.room_state() of the room they are in
+State = tuple[int, int, int, tuple[int, ...]]
+Entry = tuple[int, int, int]
+
+WIN: str = "win"
+LEFT_ROOM: str = "left"
+DEAD: str = "dead"
+
+# button and door timers count down from 150, the search tells them apart this many frames at a time
+TIMER_STEP: int = 10
+# after the first way out of a room, keep looking for other ones this many frames slower,
+# a room can need the player to come in higher or lower than the fastest way gets there
+EXIT_SLACK: int = 60
+
+
+class RoomResult:
+    """What the search found in one room"""
+    def __init__(self, room: int):
+        self.room: int = room
+        self.states: int = 0
+        self.exits: dict[Entry, int] = {} # where the player gets to the next room, and when
+        self.exit_states: dict[Entry, State] = {} # the state each of those exits was found in
+        self.complete: bool = True # false if the search gave up before trying everything
+        self.win: int | None = None # the first frame the ship can be reached from this room
+        self.par: int | None = None # frames spent in the room on the fastest route
+
+
+class Search:
+    """
+    Plays the rooms of one difficulty with every input on every frame, closest to the goal first
+    Uses the real App.update(), so the rules are exactly the game's
+    """
+    def __init__(self, difficulty: int, resource: str = RESOURCE_FILE, max_states: int = 500_000):
+        self.app: App = App(headless=True, resource=resource)
+        self.app.difficulty = difficulty
+        self.app.start()
+        self.initial: list[tuple[int, ...]] = []
+        self.ships: list[Tile | None] = []
+        self.counts: list[tuple[int, int]] = [] # how many key and button colours each room has
+        for room in range(self.app.nrooms):
+            self.app.camera = room
+            self.app.stream_rooms()
+            self.initial.append(self.app.room_state(room))
+            self.ships.append(self.app.level.room(room).ship)
+            self.counts.append((len(self.app.keys[room]), len(self.app.buttons[room])))
+        self.max_states: int = max_states
+
+    def restore(self, room: int, state: State) -> None:
+        """Puts the game back into a searched state"""
+        app = self.app
+        player = app.player
+        player.x, player.y, player.jumping, room_state = state
+        player.win = False
+        app.camera = room
+        app.stream_rooms()
+        app.game_state = PLAYING
+        app.set_room_state(room, room_state)
+        for keys in app.keys[room].values():
+            keys.update(app.tiles)
+        for doors in app.doors[room].values():
+            doors.update_tiles(app.tiles)
+
+    def step(self, room: int, state: State, action: int) -> State | str:
+        """Plays one frame from a state, returns the new state or how the room was left"""
+        app = self.app
+        self.restore(room, state)
+        deaths = app.state_counters["loads"]
+        app.controls.feed(action)
+        app.update()
+
+        if app.state_counters["loads"] != deaths:
+            return DEAD
+        if app.game_state == END:
+            return WIN
+        player = app.player
+        if (player.x + 4) // 128 < room:
+            return LEFT_ROOM
+        return player.x, player.y, player.jumping, app.room_state(room)
+
+    def key(self, room: int, state: State) -> tuple:
+        """
+        What the search remembers a state by: the timers of the buttons and doors are rounded
+        to TIMER_STEP frames, otherwise every frame of a pressed button is a new state
+        The door animations are left out too, they are only drawn
+        The routes found still play out exactly, they are just not always the fastest
+        """
+        x, y, jumping, room_state = state
+        if room_state == (WIN,):
+            return room_state
+        nkeys, nbuttons = self.counts[room]
+        doors = room_state[nkeys + nbuttons:]
+        return (
+            x, y, jumping,
+            room_state[:nkeys],
+            tuple(state // TIMER_STEP for state in room_state[nkeys:nkeys + nbuttons]),
+            tuple((doors[i], doors[i + 1] // TIMER_STEP) for i in range(0, len(doors), 3)),
+        )
+
+    def distance(self, room: int, state: State) -> int:
+        """
+        The fewest frames left to get out of the room or to the ship, never too many
+        The player moves 1 pixel a frame sideways and 2 up or down
+        """
+        x, y, _, _ = state
+        ship = self.ships[room]
+        if ship is None:
+            return max(0, (room + 1) * 128 - 4 - x)
+        dx = max(0, abs(x - ship[0] * 8) - 16)
+        dy = max(0, abs(y - ship[1] * 8) - 16)
+        return max(dx, dy // 2)
+
+    def search_room(
+            self,
+            room: int,
+            entries: dict[Entry, int]
+        ) -> tuple[RoomResult, dict[State, tuple[State | None, int]]]:
+        """
+        Finds the ways out of a room starting from the entries (player state: first frame)
+        Returns what was found and the parent of every state, to rebuild the inputs
+        """
+        result = RoomResult(room)
+        parents: dict[State, tuple[State | None, int]] = {}
+        seen: dict[tuple, int] = {} # the first frame each state was found on
+        # (frame + distance left, order, frame, state), the order keeps the heap from comparing states
+        queue: list[tuple[int, int, int, State]] = []
+        order = 0
+
+        for (x, y, jumping), frame in entries.items():
+            state = (x, y, jumping, self.initial[room])
+            parents[state] = (None, 0)
+            seen[self.key(room, state)] = frame
+            heappush(queue, (frame + self.distance(room, state), order, frame, state))
+            order += 1
+
+        first_exit: int | None = None
+        while queue:
+            estimate, _, frame, state = heappop(queue)
+            if frame > seen[self.key(room, state)]:
+                continue # found faster after this was queued
+            if state[3] == (WIN,):
+                result.win = frame
+                break
+            if first_exit is not None and estimate > first_exit + EXIT_SLACK:
+                break
+            x, y, jumping, _ = state
+            if (x + 4) // 128 > room:
+                if (x, y, jumping) not in result.exits:
+                    result.exits[(x, y, jumping)] = frame
+                    result.exit_states[(x, y, jumping)] = state
+                if first_exit is None:
+                    first_exit = frame
+                continue
+
+            for action in ACTIONS:
+                new = self.step(room, state, action)
+                if new in (DEAD, LEFT_ROOM):
+                    continue
+                if new == WIN:
+                    new = (0, 0, 0, (WIN,))
+                key = self.key(room, new)
+                if seen.get(key, frame + 2) <= frame + 1:
+                    continue
+                seen[key] = frame + 1
+
+                parents[new] = (state, action)
+                heappush(queue, (frame + 1 + self.distance(room, new), order, frame + 1, new))
+                order += 1
+
+            if len(seen) > self.max_states:
+                result.complete = False
+                break
+
+        result.states = len(seen)
+        return result, parents
+
+    def solve(self) -> tuple[list[RoomResult], bytes | None]:
+        """Searches the rooms in order, returns them and the inputs of the fastest win found"""
+        results: list[RoomResult] = []
+        searched: list[dict[State, tuple[State | None, int]]] = []
+        entries: dict[Entry, int] = {
+            (self.app.spawn[0], self.app.spawn[1], 0): 0
+        }
+
+        for room in range(self.app.nrooms):
+            result, parents = self.search_room(room, entries)
+            results.append(result)
+            searched.append(parents)
+            if result.win is not None or not result.exits:
+                break
+            entries = result.exits
+
+        if results[-1].win is None:
+            return results, None
+        return results, self.route(results, searched)
+
+    def route(
+            self,
+            results: list[RoomResult],
+            searched: list[dict[State, tuple[State | None, int]]]
+        ) -> bytes:
+        """Rebuilds the inputs of the win from the parents, and sets the par of each room"""
+        inputs: list[int] = []
+        state: State | None = (0, 0, 0, (WIN,))
+        frame = results[-1].win
+        for room in range(len(results) - 1, -1, -1):
+            parents = searched[room]
+            frames = 0
+            while True:
+                parent, action = parents[state]
+                if parent is None:
+                    break
+                inputs.append(action)
+                frames += 1
+                state = parent
+            results[room].par = frames
+            # the state that entered this room is the state that left the one before it
+            x, y, jumping, _ = state
+            if room:
+                state = results[room - 1].exit_states[(x, y, jumping)]
+        inputs.reverse()
+        if len(inputs) != frame:
+            raise RuntimeError(
+                f"The route rebuilt has {len(inputs)} frames, the ship was reached in {frame}"
+            )
+        return bytes(inputs)
+
+
+def solve_difficulty(
+        difficulty: int,
+        resource: str,
+        max_states: int
+    ) -> tuple[int, list[RoomResult], bytes | None, bytes]:
+    """Solves one difficulty, for the process pool"""
+    search = Search(difficulty, resource, max_states)
+    results, inputs = search.solve()
+    return difficulty, results, inputs, search.app.level.digest
+
+
+def main() -> int:
+    """Prints the report, returns the exit code"""
+    parser = ArgumentParser(description=__doc__)
+    parser.add_argument("resource", nargs="?", default=RESOURCE_FILE, help="the .pyxres file")
+    parser.add_argument(
+        "-d", "--difficulty", type=int, action="append",
+        help="only search this difficulty (1-4), can be given more than once"
+    )
+    parser.add_argument(
+        "--max-states", type=int, default=500_000, help="give up on a room after this many states"
+    )
+    parser.add_argument("--replays", help="write the fastest run of each difficulty here")
+    parser.add_argument("-j", "--jobs", type=int, default=None, help="worker processes")
+    args = parser.parse_args()
+
+    difficulties = args.difficulty or range(1, len(DIFFICULTIES) + 1)
+    failed = False
+    with ProcessPoolExecutor(args.jobs) as pool:
+        jobs = [
+            pool.submit(solve_difficulty, difficulty, args.resource, args.max_states)
+            for difficulty in difficulties
+        ]
+        for job in jobs:
+            difficulty, results, inputs, digest = job.result()
+            name = DIFFICULTIES[difficulty - 1]
+            if inputs is None:
+                failed = True
+                print(f"{name}: UNSOLVED")
+            else:
+                print(f"{name}: solvable, par {len(inputs)} frames ({len(inputs) / 30:.2f}s)")
+
+            print("  room  result       par  states")
+            for result in results:
+                if result.win is not None:
+                    verdict = "ship"
+                elif result.exits:
+                    verdict = "exit"
+                else:
+                    verdict = "stuck" if result.complete else "gave up"
+                par = "-" if result.par is None else str(result.par)
+                print(f"  {result.room:>4}  {verdict:<9} {par:>6}  {result.states:>6}")
+
+            if inputs is not None and args.replays:
+                replay = Replay(difficulty, digest, inputs)
+                # only a replay that plays back to the ship in the par time is written
+                win, frames = verify_replay(replay, args.resource)
+                if not win or frames != len(inputs):
+                    failed = True
+                    print(f"  the par replay doesn't verify: won {win} in {frames} frames")
+                    continue
+                makedirs(args.replays, exist_ok=True)
+                replay.save(path.join(args.replays, f"par-{name}.swr"))
+
+    return int(failed)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
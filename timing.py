@@ -0,0 +1,118 @@
+"""Checks the SpaceWarp clock counts against a scripted pyxel schedule, with a fake timer"""
+from __future__ import annotations
+from argparse import ArgumentParser
+import random
+import sys
+from main import (
+    App, BTN_LEFT, BTN_RIGHT, BTN_SPACE, BTN_UP, Clock, PLAYING, RESOURCE_FILE, TICK_JITTER,
+    TICK_RATE
+)
+
+TICK: float = 1 / TICK_RATE
+# the buttons pressed, a different one almost every update so a lost or repeated one shows
+TAPS: tuple[int, ...] = (
+    0, BTN_LEFT, BTN_RIGHT, BTN_UP, BTN_SPACE, BTN_LEFT | BTN_UP, BTN_RIGHT | BTN_SPACE
+)
+
+
+class FakeTimer:
+    """Stands in for time.perf_counter, the schedule sets the time"""
+    def __init__(self):
+        self.now: float = 0.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+class Schedule:
+    """
+    Calls App.tick() and Clock.render() the way pyxel.run would: updates every TICK, and after
+    a slow render the updates that are due back to back before the next render
+    """
+    def __init__(self, app: App, timer: FakeTimer, seed: int):
+        self.app: App = app
+        self.timer: FakeTimer = timer
+        self.due: float = 0.0 # when pyxel means the next update to run
+        self.random: random.Random = random.Random(seed)
+        self.sent: bytearray = bytearray() # the buttons read by every update, in order
+        self.updates: int = 0
+
+    def frame(self, updates: int = 1, render: float = 0.0, jitter: float = 0.0) -> None:
+        """
+        Runs updates back to back and a render that takes render ticks, the first update is
+        late by up to jitter of a tick, every update holds a different tap of buttons
+        """
+        self.timer.now = self.due + self.random.uniform(0, jitter) * TICK
+        for _ in range(updates):
+            buttons = self.random.choice(TAPS)
+            self.sent.append(buttons)
+            self.updates += 1
+            self.app.tick(buttons)
+        self.app.clock.render()
+        self.due += max(1, render) * TICK
+
+
+def check(resource: str, seed: int) -> list[str]:
+    """Plays a schedule with a steady run, slow renders and a stall, returns what went wrong"""
+    errors = []
+    timer = FakeTimer()
+    app = App(headless=True, resource=resource)
+    app.clock = Clock(timer=timer)
+    app.difficulty = 1
+    app.start()
+    schedule = Schedule(app, timer, seed)
+
+    def expect(what: str, lag: int, skipped: int) -> None:
+        clock = app.clock
+        if (clock.lag_frames, clock.skipped_ticks) != (lag, skipped):
+            errors.append(
+                f"{what}: lag {clock.lag_frames} skipped {clock.skipped_ticks}, "
+                f"expected lag {lag} skipped {skipped}"
+            )
+
+    for _ in range(TICK_RATE * 3):
+        schedule.frame(jitter=TICK_JITTER / 2)
+    expect("steady", 0, 0)
+
+    # a render of 3 ticks is made up with 3 updates before the next one, nothing is dropped
+    schedule.frame(render=3)
+    schedule.frame(updates=3)
+    schedule.frame()
+    expect("slow render", 1, 0)
+
+    # a stall of 20 ticks where pyxel only catches up 4 updates drops the other 16
+    schedule.frame(render=20)
+    schedule.frame(updates=4)
+    for _ in range(TICK_RATE):
+        schedule.frame(jitter=TICK_JITTER / 2)
+    expect("stall", 2, 16)
+
+    if app.game_state != PLAYING:
+        errors.append("the run ended before the schedule did")
+    # every update gets the buttons read for it, a tap held for one update is never lost
+    if bytes(app.recording[:app.recorded]) != bytes(schedule.sent):
+        errors.append("the inputs recorded aren't the buttons read on every update")
+    if app.frame_count - app.start_frame != schedule.updates:
+        errors.append(
+            f"{app.frame_count - app.start_frame} frames ran for {schedule.updates} updates"
+        )
+    return errors
+
+
+def main() -> int:
+    """Runs the check, returns the exit code"""
+    parser = ArgumentParser(description=__doc__)
+    parser.add_argument("resource", nargs="?", default=RESOURCE_FILE, help="the .pyxres file")
+    parser.add_argument("-s", "--seed", type=int, default=0, help="the seed of the buttons")
+    args = parser.parse_args()
+
+    errors = check(args.resource, args.seed)
+    for error in errors:
+        print(f"error: {error}")
+    if not errors:
+        print("the clock counts and inputs match the schedule")
+    return int(bool(errors))
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,71 @@
+"""Checks every room of every SpaceWarp difficulty and reports all misplaced tiles"""
+from __future__ import annotations
+from argparse import ArgumentParser
+from concurrent.futures import ProcessPoolExecutor
+import sys
+from main import (
+    DIFFICULTIES, LEVEL_TILEMAPS, RESOURCE_FILE, TileGrid, get_nrooms, load_tilemaps, parse_level
+)
+
+tilemaps: list[TileGrid] = [] # loaded once in each worker process
+
+
+def load_worker(resource: str) -> None:
+    """Loads the tilemaps in a worker process"""
+    tilemaps[:] = load_tilemaps(resource)
+
+
+def check_room(difficulty: int, room: int) -> tuple[int, int, list[str]]:
+    """Checks one room of a difficulty, returns the difficulty, the room and its errors"""
+    errors = []
+    tilemap, local = divmod(room, 16)
+    parse_level(tilemaps[LEVEL_TILEMAPS[difficulty][tilemap]], errors, [local], digest=False)
+    return difficulty, room, [str(error) for error in errors]
+
+
+def count_rooms(difficulty: int) -> int:
+    """Counts the rooms of a difficulty over all of its tilemaps"""
+    nrooms = 0
+    for tilemap in LEVEL_TILEMAPS[difficulty]:
+        nrooms += get_nrooms(tilemaps[tilemap])
+        if get_nrooms(tilemaps[tilemap]) < 16:
+            break
+    return nrooms
+
+
+def main() -> int:
+    """Validates the resource file, returns the exit code"""
+    parser = ArgumentParser(description=__doc__)
+    parser.add_argument("resource", nargs="?", default=RESOURCE_FILE, help="the .pyxres file")
+    parser.add_argument("-j", "--jobs", type=int, default=None, help="worker processes")
+    args = parser.parse_args()
+
+    load_worker(args.resource)
+    nrooms = {
+        difficulty: count_rooms(difficulty) for difficulty in range(1, len(DIFFICULTIES) + 1)
+    }
+
+    errors: dict[int, list[tuple[int, str]]] = {difficulty: [] for difficulty in nrooms}
+    with ProcessPoolExecutor(args.jobs, initializer=load_worker, initargs=(args.resource,)) as pool:
+        jobs = [
+            pool.submit(check_room, difficulty, room)
+            for difficulty, rooms in nrooms.items() for room in range(rooms)
+        ]
+        for job in jobs:
+            difficulty, room, room_errors = job.result()
+            errors[difficulty] += ((room, error) for error in room_errors)
+
+    for difficulty, rooms in nrooms.items():
+        found = errors[difficulty]
+        print(
+            f"{DIFFICULTIES[difficulty - 1]}: {rooms} rooms, "
+            + (f"{len(found)} error{'s' * (len(found) > 1)}" if found else "ok")
+        )
+        for room, error in found:
+            print(f"  room {room}: {error}")
+
+    return int(any(errors.values()))
+
+
+if __name__ == "__main__":
+    sys.exit(main())